@@ -0,0 +1,185 @@
+"""Headless batch processing of a directory or a list of PDFs.
+
+    python batch.py /archive/2023 --workers 16 --report report.jsonl
+    python batch.py --file-list todo.txt --dry-run
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from pubsub import pub
+
+from config import Config
+from app.src.log_events import print_log
+from app.src.startup import startup_profile
+
+
+def collect_pdf_paths(paths, file_list=None, recursive=False):
+    pdf_paths = []
+    if file_list:
+        with open(file_list, encoding='utf-8') as f:
+            paths = list(paths) + [line.strip() for line in f if line.strip()]
+
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                for directory, _, filenames in os.walk(path):
+                    pdf_paths.extend(os.path.join(directory, name) for name in sorted(filenames) if name.endswith('.pdf'))
+            else:
+                pdf_paths.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.pdf'))
+        else:
+            pdf_paths.append(path)
+    return pdf_paths
+
+
+class ReportWriter:
+    """Appends one JSON line per finished document"""
+
+    def __init__(self, report_path, dry_run):
+        self.dry_run = dry_run
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.file = open(report_path, 'a', encoding='utf-8') if report_path else None
+
+    def write(self, job):
+        if job.parts:
+            status = "split"
+        elif job.failed_stage:
+            status = f"failed_{job.failed_stage}"
+        else:
+            status = "dry_run" if self.dry_run else "routed"
+
+        record = {
+            "pdf_path": job.pdf_path,
+            "status": status,
+            "error": job.error,
+            "letter_details": job.letter_details.model_dump() if job.letter_details else None,
+            "worker_name": job.worker_name,
+            "csv_filename": job.csv_filename,
+            "matched_receiver": job.matched_receiver,
+            "output_path": job.output_path,
+            "parts": job.parts,
+            "timings": {stage: round(seconds, 4) for stage, seconds in job.timings.items()},
+        }
+
+        self._append(status, record)
+
+    def write_rejected(self, pdf_path, status, error):
+        """Record a file the pipeline did not accept"""
+        self._append(status, {"pdf_path": pdf_path, "status": status, "error": error})
+
+    def _append(self, status, record):
+        with self.lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+            if self.file:
+                self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Process PDFs without the GUI")
+    parser.add_argument("paths", nargs="*", help="PDF files or directories containing PDFs")
+    parser.add_argument("--file-list", help="Text file with one PDF path per line")
+    parser.add_argument("--recursive", action="store_true", help="Descend into subdirectories")
+    parser.add_argument("--output-dir", default=Config.settings.output_dir)
+    parser.add_argument("--csv-dir", default=Config.settings.csv_files)
+    parser.add_argument("--workers", type=int, help="OCR processes (defaults to ocr_workers)")
+    parser.add_argument("--llm-workers", type=int, help="Concurrent analysis calls (defaults to analyze_workers)")
+    parser.add_argument("--dry-run", action="store_true", help="Run every stage but leave all files in place")
+    parser.add_argument("--report", default="report.jsonl", help="JSONL report path, appended to")
+    parser.add_argument("--quiet", action="store_true", help="Do not print log events")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this port while running")
+    parser.add_argument("--metrics-snapshot", help="Write a JSON metrics snapshot to this path")
+    parser.add_argument("--profile-startup", action="store_true", help="Report where startup time goes")
+    args = parser.parse_args(argv)
+    if args.profile_startup:
+        startup_profile.enable()
+
+    if args.workers:
+        Config.settings.ocr_workers = args.workers
+    if args.llm_workers:
+        Config.settings.analyze_workers = args.llm_workers
+        Config.settings.llm_max_concurrency = args.llm_workers
+    if args.metrics_port:
+        Config.settings.metrics_port = args.metrics_port
+    if args.metrics_snapshot:
+        Config.settings.metrics_snapshot_path = args.metrics_snapshot
+
+    pdf_paths = collect_pdf_paths(args.paths, args.file_list, args.recursive)
+    if not pdf_paths:
+        parser.error("no PDF files given")
+
+    if not args.quiet:
+        pub.subscribe(print_log, 'log_event')
+
+    # Imported here so --help does not pay for loading the OCR and LLM stack
+    from app.src.core import CoreApplication
+    from app.src.metrics import MetricsExporter
+    from app.src.pipeline import Pipeline
+    from app.src.pdf_processor import header_stats, page_source_stats
+    from app.src.pre_extractor import pre_extraction_stats
+    startup_profile.mark("imports")
+
+    app = CoreApplication(Config.settings.openai_api_key, Config.settings.language, args.csv_dir,
+                          args.output_dir, dry_run=args.dry_run)
+    report = ReportWriter(args.report, args.dry_run)
+    pipeline = Pipeline(app, on_complete=report.write)
+    metrics_exporter = MetricsExporter()
+
+    started = time.monotonic()
+    metrics_exporter.start()
+    pipeline.start()
+    startup_profile.mark("pipeline ready")
+    if Config.settings.startup_warm_up:
+        # Loads the chat model while the first documents are still being OCR'd
+        threading.Thread(target=app.pdf_processor.client.warm_up, name="llm-warm-up", daemon=True).start()
+    submitted = set()
+    try:
+        for pdf_path in pdf_paths:
+            if os.path.abspath(pdf_path) in submitted:
+                report.write_rejected(pdf_path, "skipped", "listed more than once")
+                continue
+            try:
+                queued = pipeline.submit(pdf_path)
+            except Exception as e:
+                # The file could not be hashed or journaled
+                report.write_rejected(pdf_path, "failed", str(e))
+                continue
+            if queued:
+                submitted.add(os.path.abspath(pdf_path))
+            elif not os.path.exists(pdf_path):
+                report.write_rejected(pdf_path, "failed", "file not found")
+            else:
+                report.write_rejected(pdf_path, "skipped", "already in the pipeline")
+    finally:
+        pipeline.stop()
+        report.close()
+        metrics_exporter.stop()
+    startup_profile.mark("all documents done")
+    if startup_profile.enabled:
+        print(startup_profile.report(), file=sys.stderr)
+
+    elapsed = time.monotonic() - started
+    summary = ", ".join(f"{count} {status}" for status, count in sorted(report.counts.items()))
+    print(f"Processed {len(submitted)} of {len(pdf_paths)} PDFs in {elapsed:.1f}s "
+          f"({len(submitted) / elapsed * 60:.1f} docs/min): {summary}")
+    if Config.settings.text_layer_enabled:
+        pages = page_source_stats.snapshot()
+        print(f"Pages: {pages['text_layer_pages']} from the text layer, {pages['ocr_pages']} OCR'd "
+              f"({pages['text_layer_ratio']:.0%} without OCR)")
+    if Config.settings.roi_ocr_enabled:
+        header = header_stats.snapshot()
+        print(f"Header pass: {header['resolved']} resolved, {header['escalated']} read in full, "
+              f"~{header['prompt_tokens_saved_estimate']} prompt tokens saved")
+    if Config.settings.pre_extract_enabled:
+        pre_extraction = pre_extraction_stats.snapshot()
+        print(f"Pre-extraction: LLM skipped for {pre_extraction['skipped']}, summary only for "
+              f"{pre_extraction['summary_only']}, full analysis for {pre_extraction['full']} "
+              f"({pre_extraction['full_analysis_skip_rate']:.0%} without a full analysis)")
+    return 0 if all(status in ("routed", "dry_run", "split", "skipped") for status in report.counts) else 1
@@ -0,0 +1,439 @@
+"""Throughput benchmark on synthetic letters, against the local LLM stub.
+
+    python benchmark.py --documents 50 --max-pages 3 --text-layer-ratio 0.5
+    python benchmark.py --mode watcher --compare benchmarks/baseline.json
+
+Generates recipient CSVs and scanned-looking letters addressed to those
+recipients, runs them through the full pipeline and writes docs/min, p50/p95
+per-stage latency and peak RSS to a JSON result file. With --compare the run
+fails when it is slower than a previous result by more than --tolerance.
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from pubsub import pub
+
+from config import Config
+from app.src.log_events import print_log
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then left out of the report
+    resource = None
+
+FIRST_NAMES = ("Anna", "Ben", "Clara", "David", "Emma", "Felix", "Greta", "Hans", "Ines", "Jonas",
+               "Karla", "Lukas", "Mia", "Noah", "Olga", "Paul", "Rita", "Simon", "Tina", "Uwe")
+LAST_NAMES = ("Adler", "Bauer", "Becker", "Fischer", "Hartmann", "Hoffmann", "Keller", "Koch", "Lange",
+              "Meyer", "Neumann", "Richter", "Schmidt", "Schulz", "Wagner", "Weber", "Wolf", "Zimmermann")
+ORGANISATIONS = ("ACME Insurance Ltd", "City Tax Office", "Northwind Energy", "Contoso Bank",
+                 "Fabrikam Health Fund", "Globex Telecom", "Initech Pensions", "Umbrella Housing")
+SUBJECTS = ("Annual statement", "Payment reminder", "Contract renewal", "Change of address",
+            "Tax assessment", "Appointment confirmation", "Policy update", "Account closure")
+FILLER = ("We refer to our previous correspondence and kindly ask you to review the enclosed documents "
+          "at your earliest convenience. Should you have any questions regarding this matter please do "
+          "not hesitate to contact our customer service team who will be glad to assist you further")
+
+PAGE_SIZE_INCHES = (8.27, 11.69)
+FONT_POINTS = 11
+LINE_POINTS = 15
+MARGIN_POINTS = 72
+
+
+def generate_recipients(csv_dir, workers, recipients_per_worker, rng):
+    """Write one CSV per worker and return [(worker, recipient)] for every generated row"""
+    os.makedirs(csv_dir, exist_ok=True)
+    names = [f"{first} {last}" for first in FIRST_NAMES for last in LAST_NAMES]
+    rows = []
+    for index in range(workers):
+        worker = f"Worker_{index:03d}"
+        with open(os.path.join(csv_dir, f"{worker}.csv"), 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            for row in range(recipients_per_worker):
+                # Suffixes keep every recipient unique however large the lists get
+                recipient = f"{rng.choice(names)} {index * recipients_per_worker + row}"
+                writer.writerow([recipient])
+                rows.append((worker, recipient))
+    return rows
+
+
+def letter_lines(recipient, page_number, page_count, rng):
+    words = FILLER.split()
+    body = []
+    for _ in range(rng.randint(8, 16)):
+        start = rng.randrange(len(words) - 10)
+        body.append(" ".join(words[start:start + 10]))
+
+    if page_number > 1:
+        return [f"Page {page_number} of {page_count}", ""] + body
+
+    return [
+        f"From: {rng.choice(ORGANISATIONS)}",
+        f"To: {recipient}",
+        f"Date: {rng.randint(1, 28):02d}.{rng.randint(1, 12):02d}.{rng.randint(2019, 2024)}",
+        f"Subject: {rng.choice(SUBJECTS)}",
+        "",
+        f"Dear {recipient.split()[0]}",
+    ] + body
+
+
+def render_page(lines, dpi, noise, skew, rng):
+    from PIL import Image, ImageDraw, ImageFont
+
+    width, height = int(PAGE_SIZE_INCHES[0] * dpi), int(PAGE_SIZE_INCHES[1] * dpi)
+    page = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(page)
+    try:
+        font = ImageFont.load_default(size=FONT_POINTS * dpi / 72)
+    except TypeError:
+        font = ImageFont.load_default()
+
+    y = MARGIN_POINTS * dpi / 72
+    for line in lines:
+        draw.text((MARGIN_POINTS * dpi / 72, y), line, fill=0, font=font)
+        y += LINE_POINTS * dpi / 72
+
+    if skew:
+        page = page.rotate(rng.uniform(-skew, skew), fillcolor=255, resample=Image.BICUBIC)
+    if noise:
+        # Salt-and-pepper speckles, like dust on the scanner glass
+        pixels = page.load()
+        for _ in range(int(width * height * noise)):
+            pixels[rng.randrange(width), rng.randrange(height)] = rng.choice((0, 255))
+    return page
+
+
+def pdf_string(text):
+    return "(" + text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") + ")"
+
+
+def write_scanned_pdf(path, pages, text_layer_lines=None):
+    """Write page images as a PDF; with text_layer_lines, an invisible text layer is added as OCR software does"""
+    page_width, page_height = PAGE_SIZE_INCHES[0] * 72, PAGE_SIZE_INCHES[1] * 72
+    objects = []
+
+    def add(data):
+        objects.append(data if isinstance(data, bytes) else data.encode("latin-1"))
+        return len(objects)
+
+    catalog = add("")
+    page_tree = add("")
+    font = add("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for index, image in enumerate(pages):
+        encoded = io.BytesIO()
+        image.save(encoded, format="JPEG", quality=75)
+        data = encoded.getvalue()
+        image_id = add(
+            f"<< /Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} "
+            f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /DCTDecode /Length {len(data)} >>\nstream\n".encode()
+            + data + b"\nendstream"
+        )
+
+        content = f"q {page_width:.2f} 0 0 {page_height:.2f} 0 0 cm /Im0 Do Q\n"
+        if text_layer_lines:
+            # Render mode 3 draws nothing; the text is only there to be extracted
+            content += f"BT 3 Tr /F1 {FONT_POINTS} Tf {LINE_POINTS} TL {MARGIN_POINTS} {page_height - MARGIN_POINTS - FONT_POINTS} Td\n"
+            content += "".join(f"{pdf_string(line)} '\n" for line in text_layer_lines[index]) + "ET\n"
+        stream = zlib.compress(content.encode("latin-1"))
+        content_id = add(f"<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode() + stream + b"\nendstream")
+
+        page_ids.append(add(
+            f"<< /Type /Page /Parent {page_tree} 0 R /MediaBox [0 0 {page_width:.2f} {page_height:.2f}] "
+            f"/Contents {content_id} 0 R /Resources << /XObject << /Im0 {image_id} 0 R >> /Font << /F1 {font} 0 R >> >> >>"
+        ))
+
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {page_tree} 0 R >>".encode()
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[page_tree - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, data in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n".encode() + data + b"\nendobj\n"
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+
+    with open(path, 'wb') as f:
+        f.write(output)
+
+
+def generate_letters(letter_dir, recipients, options, rng):
+    """Write options.documents letters and return their paths"""
+    os.makedirs(letter_dir, exist_ok=True)
+    paths = []
+    for index in range(options.documents):
+        _, recipient = rng.choice(recipients)
+        page_count = rng.randint(options.min_pages, max(options.min_pages, options.max_pages))
+        lines = [letter_lines(recipient, number, page_count, rng) for number in range(1, page_count + 1)]
+        pages = [render_page(page_lines, options.dpi, options.noise, options.skew, rng) for page_lines in lines]
+        with_text_layer = rng.random() < options.text_layer_ratio
+
+        path = os.path.join(letter_dir, f"letter_{index:05d}.pdf")
+        write_scanned_pdf(path, pages, lines if with_text_layer else None)
+        paths.append(path)
+    return paths
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and of its largest child (the OCR pool)"""
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+class JobCollector:
+    def __init__(self, expected):
+        self.expected = expected
+        self.jobs = []
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def add(self, job):
+        with self.lock:
+            job.completed_at = time.monotonic()
+            self.jobs.append(job)
+            if len(self.jobs) >= self.expected:
+                self.finished.set()
+
+
+def run_pipeline(app, paths, collector):
+    from app.src.pipeline import Pipeline
+
+    pipeline = Pipeline(app, on_complete=collector.add)
+    pipeline.start()
+    try:
+        for path in paths:
+            pipeline.submit(path)
+    finally:
+        pipeline.stop()
+
+
+def run_watcher(paths, inbox, output_dir, csv_dir, collector, timeout):
+    """Drop the letters into a watched inbox and wait until every one has come out of the pipeline.
+
+    Returns when the first letter was dropped, so the watcher's startup is not counted.
+    """
+    from app.src.watcher import Watcher
+
+    os.makedirs(inbox, exist_ok=True)
+    stop_event = threading.Event()
+    watcher = Watcher(Config.settings.openai_api_key, Config.settings.language, csv_dir, on_complete=collector.add)
+    thread = threading.Thread(target=watcher.start, args=(output_dir, inbox, stop_event), name="benchmark-watcher")
+    thread.start()
+    # Give the observer time to start before the first arrival
+    time.sleep(1)
+    dropped_at = time.monotonic()
+    for path in paths:
+        # Written under a temporary name and renamed, as scanners and sync tools do
+        temporary = os.path.join(inbox, os.path.basename(path) + ".tmp")
+        shutil.copyfile(path, temporary)
+        os.replace(temporary, os.path.join(inbox, os.path.basename(path)))
+
+    if not collector.finished.wait(timeout):
+        pub.sendMessage('log_event', message=f"Timed out with {len(collector.jobs)}/{collector.expected} documents done")
+    stop_event.set()
+    thread.join()
+    return dropped_at
+
+
+def summarize(collector, elapsed, submitted_at):
+    jobs = collector.jobs
+    stages = {}
+    for job in jobs:
+        for stage, seconds in job.timings.items():
+            stages.setdefault(stage, []).append(seconds)
+
+    latencies = [job.completed_at - job.submitted_at for job in jobs]
+    statuses = {}
+    for job in jobs:
+        status = "split" if job.parts else f"failed_{job.failed_stage}" if job.failed_stage else "done"
+        statuses[status] = statuses.get(status, 0) + 1
+
+    return {
+        "documents": len(jobs),
+        "statuses": statuses,
+        "elapsed_seconds": round(elapsed, 3),
+        "docs_per_minute": round(len(jobs) / elapsed * 60, 2) if elapsed else 0.0,
+        "first_document_seconds": round(min((job.completed_at for job in jobs), default=submitted_at) - submitted_at, 3),
+        "document_latency": {"p50": percentile(latencies, 0.5), "p95": percentile(latencies, 0.95)},
+        "stages": {
+            stage: {
+                "p50": round(percentile(values, 0.5), 4),
+                "p95": round(percentile(values, 0.95), 4),
+                "mean": round(sum(values) / len(values), 4),
+            }
+            for stage, values in stages.items()
+        },
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Return the regressions of result against baseline as readable strings"""
+    regressions = []
+    old_rate, new_rate = baseline["results"]["docs_per_minute"], result["results"]["docs_per_minute"]
+    if old_rate and new_rate < old_rate * (1 - tolerance):
+        regressions.append(f"docs/min {new_rate} < {old_rate}")
+
+    for stage, old in baseline["results"]["stages"].items():
+        new = result["results"]["stages"].get(stage)
+        # Differences of a few milliseconds are noise, not regressions
+        if new and new["p95"] > old["p95"] * (1 + tolerance) and new["p95"] - old["p95"] > 0.01:
+            regressions.append(f"{stage} p95 {new['p95']}s > {old['p95']}s")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic letters")
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--min-pages", type=int, default=1)
+    parser.add_argument("--max-pages", type=int, default=3)
+    parser.add_argument("--dpi", type=int, default=200, help="Resolution of the simulated scan")
+    parser.add_argument("--noise", type=float, default=0.002, help="Fraction of pixels turned into speckles")
+    parser.add_argument("--skew", type=float, default=1.0, help="Maximum page rotation in degrees")
+    parser.add_argument("--text-layer-ratio", type=float, default=0.0, help="Fraction of letters with a text layer")
+    parser.add_argument("--workers", type=int, default=10, help="Number of recipient CSV files")
+    parser.add_argument("--recipients", type=int, default=100, help="Recipients per CSV file")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds the stub LLM waits per call")
+    parser.add_argument("--mode", choices=("pipeline", "watcher"), default="pipeline",
+                        help="Submit letters directly, or drop them into a watched inbox")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--work-dir", help="Keep generated files here instead of a temporary directory")
+    parser.add_argument("--output", help="Result JSON path (default: benchmarks/<timestamp>.json)")
+    parser.add_argument("--compare", help="Earlier result JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed slowdown against --compare")
+    parser.add_argument("--timeout", type=float, default=600.0, help="Watcher mode: seconds to wait for all letters")
+    parser.add_argument("--verbose", action="store_true", help="Print log events")
+    args = parser.parse_args(argv)
+
+    if args.verbose:
+        pub.subscribe(print_log, 'log_event')
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="lettereye-bench-")
+    csv_dir = os.path.join(work_dir, "csv")
+    letter_dir = os.path.join(work_dir, "letters")
+    output_dir = os.path.join(work_dir, "output")
+    for directory in (csv_dir, letter_dir, output_dir, os.path.join(work_dir, "inbox")):
+        shutil.rmtree(directory, ignore_errors=True)
+
+    rng = random.Random(args.seed)
+    started = time.monotonic()
+    recipients = generate_recipients(csv_dir, args.workers, args.recipients, rng)
+    paths = generate_letters(letter_dir, recipients, args, rng)
+    print(f"Generated {len(paths)} letters and {len(recipients)} recipients in {time.monotonic() - started:.1f}s")
+
+    from app.src.stub_llm import start_stub_server
+    stub = start_stub_server(latency=args.llm_latency, seed=args.seed)
+
+    # Cold, isolated runs: no cached results, no journal, nothing shared with a real deployment
+    settings = Config.settings
+    settings.openai_base_url = stub.base_url
+    settings.openai_api_key = "benchmark"
+    settings.cache_enabled = False
+    settings.journal_enabled = False
+    settings.claims_enabled = False
+    settings.backlog_scan_enabled = False
+    settings.metrics_port = 0
+    settings.metrics_snapshot_path = ""
+
+    from app.src.core import CoreApplication
+    from app.src.pdf_processor import page_source_stats
+    from app.src.pre_extractor import pre_extraction_stats
+
+    collector = JobCollector(len(paths))
+    if args.mode == "watcher":
+        started = run_watcher(paths, os.path.join(work_dir, "inbox"), output_dir, csv_dir, collector, args.timeout)
+        # The watcher keeps running until the last letter is done; measure up to that point
+        finished = max((job.completed_at for job in collector.jobs), default=time.monotonic())
+    else:
+        app = CoreApplication(settings.openai_api_key, settings.language, csv_dir, output_dir)
+        started = time.monotonic()
+        run_pipeline(app, paths, collector)
+        finished = time.monotonic()
+    elapsed = finished - started
+    stub.shutdown()
+
+    result = {
+        "benchmark": "lettereye",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "parameters": {key: value for key, value in vars(args).items()
+                       if key not in ("output", "compare", "work_dir", "verbose")},
+        "settings": {key: getattr(settings, key) for key in (
+            "convert_workers", "ocr_stage_workers", "ocr_workers", "parallel_ocr", "analyze_workers",
+            "route_workers", "pipeline_queue_size", "raster_dpi", "raster_window", "text_layer_enabled",
+            "roi_ocr_enabled", "llm_max_concurrency", "pre_extract_enabled", "pre_extract_min_confidence",
+        )},
+        "results": summarize(collector, elapsed, started),
+    }
+    result["results"]["pages"] = page_source_stats.snapshot()
+    result["results"]["pre_extraction"] = pre_extraction_stats.snapshot()
+
+    output = args.output or os.path.join("benchmarks", time.strftime("%Y%m%d-%H%M%S") + ".json")
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+
+    summary = result["results"]
+    print(f"{summary['documents']} documents in {summary['elapsed_seconds']}s: {summary['docs_per_minute']} docs/min, "
+          f"statuses {summary['statuses']}, peak RSS {summary['peak_rss_mb']}")
+    for stage, values in summary["stages"].items():
+        print(f"  {stage:8s} p50 {values['p50']:.3f}s  p95 {values['p95']:.3f}s")
+    print(f"  pages: {summary['pages']['text_layer_ratio']:.0%} from the text layer")
+    pre_extraction = summary["pre_extraction"]
+    print(f"  pre-extraction: LLM skipped {pre_extraction['llm_skip_rate']:.0%}, "
+          f"full analysis skipped {pre_extraction['full_analysis_skip_rate']:.0%}")
+    print(f"Result written to {output}")
+
+    if not args.work_dir:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
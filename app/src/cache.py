@@ -0,0 +1,139 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from config import Config
+from app.src.metrics import metrics
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Shared cache instance, or None when caching is disabled"""
+    global _cache
+    with _cache_lock:
+        if _cache is None and Config.settings.cache_enabled:
+            _cache = ResultCache(
+                Config.settings.cache_path,
+                max_bytes=Config.settings.cache_max_mb * 1024 * 1024,
+                max_age_days=Config.settings.cache_max_age_days,
+            )
+        return _cache
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_image(image):
+    digest = hashlib.sha256()
+    digest.update(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def hash_text(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Persistent key/value store for OCR text and analysis results.
+
+    Entries are grouped by kind ("document", "page", "analysis", "summary") and keyed by a
+    content hash, so a re-dropped or duplicated file costs only a hash computation.
+    """
+
+    EVICT_EVERY = 100
+
+    def __init__(self, path, max_bytes, max_age_days):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.lock = threading.Lock()
+        self.puts_since_eviction = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " kind TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " accessed_at REAL NOT NULL,"
+            " PRIMARY KEY (kind, key))"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed_at)")
+        self.connection.commit()
+        self.evict()
+
+    def get(self, kind, key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value FROM entries WHERE kind = ? AND key = ?", (kind, key)
+            ).fetchone()
+            if row is None:
+                metrics.inc("cache_misses_total", kind=kind)
+                return None
+
+            metrics.inc("cache_hits_total", kind=kind)
+            self.connection.execute(
+                "UPDATE entries SET accessed_at = ? WHERE kind = ? AND key = ?", (time.time(), kind, key)
+            )
+            self.connection.commit()
+            return row[0]
+
+    def put(self, kind, key, value):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (kind, key, value, size, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, key, value, len(value.encode('utf-8')), now, now),
+            )
+            self.connection.commit()
+            self.puts_since_eviction += 1
+            evict = self.puts_since_eviction >= self.EVICT_EVERY
+
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Drop entries past the age limit, then the least recently used until under the size limit"""
+        with self.lock:
+            self.puts_since_eviction = 0
+            if self.max_age_seconds > 0:
+                self.connection.execute(
+                    "DELETE FROM entries WHERE created_at < ?", (time.time() - self.max_age_seconds,)
+                )
+
+            total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if self.max_bytes > 0 and total > self.max_bytes:
+                rows = self.connection.execute("SELECT kind, key, size FROM entries ORDER BY accessed_at").fetchall()
+                doomed = []
+                for kind, key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    doomed.append((kind, key))
+                    total -= size
+                self.connection.executemany("DELETE FROM entries WHERE kind = ? AND key = ?", doomed)
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
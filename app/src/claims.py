@@ -0,0 +1,166 @@
+import os
+import socket
+import threading
+import time
+import uuid
+from pubsub import pub
+
+from app.src.log_events import WARNING
+
+LEASE_FILE = ".lease"
+
+
+class InboxClaims:
+    """Lets several instances share one inbox, each PDF being processed by exactly one of them.
+
+    An instance claims a PDF by renaming it into its own directory under
+    <inbox>/<claim_dir_name>/<instance id>/; the rename is atomic, so only one
+    instance can win. Each instance keeps a lease file in its directory fresh
+    while it runs. When another instance's lease goes stale, its claimed PDFs
+    are moved back into the inbox for anyone to pick up.
+    """
+
+    def __init__(self, inbox, instance_id, dir_name, lease_seconds):
+        self.inbox = os.path.normpath(inbox)
+        self.instance_id = instance_id or socket.gethostname()
+        self.root = os.path.join(self.inbox, dir_name)
+        self.directory = os.path.join(self.root, self.instance_id)
+        self.lease_path = os.path.join(self.directory, LEASE_FILE)
+        self.lease_seconds = lease_seconds
+        # Written into the lease file so a second process with the same instance id can tell it is not the owner
+        self.token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        self.stop_event = threading.Event()
+        self.thread = None
+        # Serializes picking a free name in this instance's directory, which no other process writes to
+        self.claim_lock = threading.Lock()
+
+    def start(self):
+        """Take the lease for this instance id, waiting out a lease held by another live process"""
+        os.makedirs(self.directory, exist_ok=True)
+        while self._lease_held_by_other():
+            pub.sendMessage('log_event', message=(
+                f"Instance id {self.instance_id} is leased by another process, waiting for the lease to expire"
+            ))
+            time.sleep(self.lease_seconds / 3)
+        self._renew()
+        pub.sendMessage('log_event', message=f"Claiming inbox files as instance {self.instance_id}")
+
+        self.recover_orphans()
+        self.thread = threading.Thread(target=self._heartbeat, name="inbox-lease", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        # Claimed files that were not finished stay here and are picked up on the next start
+        try:
+            os.remove(self.lease_path)
+        except FileNotFoundError:
+            pass
+
+    def claim(self, pdf_path):
+        """Move a PDF from the inbox into this instance's directory; None if another instance has it"""
+        pdf_path = os.path.normpath(pdf_path)
+        if self.owns(pdf_path):
+            return pdf_path
+        if os.path.dirname(pdf_path) != self.inbox:
+            return None
+
+        with self.claim_lock:
+            # A file of the same name may still be in flight here; renaming over it would lose that letter
+            claimed_path = self._free_path(self.directory, os.path.basename(pdf_path), "claim")
+            try:
+                os.rename(pdf_path, claimed_path)
+            except FileNotFoundError:
+                pub.sendMessage('log_event', message=f"{pdf_path} was claimed by another instance")
+                return None
+        return claimed_path
+
+    def release(self, claimed_path, name):
+        """Give a claimed PDF back to the inbox under name, or a free variant of it, and return its path"""
+        with self.claim_lock:
+            target = self._free_inbox_path(name)
+            os.rename(claimed_path, target)
+        return target
+
+    def owns(self, pdf_path):
+        return os.path.dirname(os.path.normpath(pdf_path)) == self.directory
+
+    def claimed_files(self):
+        """PDFs left in this instance's directory by an earlier run"""
+        return sorted(entry.path for entry in os.scandir(self.directory)
+                      if entry.is_file() and entry.name.endswith('.pdf'))
+
+    def recover_orphans(self):
+        """Return the claims of instances whose lease has expired to the inbox"""
+        now = self._renew()
+        for entry in os.scandir(self.root):
+            if not entry.is_dir() or entry.path == self.directory:
+                continue
+            lease_path = os.path.join(entry.path, LEASE_FILE)
+            try:
+                # Both timestamps come from the shared filesystem, so clock skew between hosts does not matter
+                expired = now - os.stat(lease_path).st_mtime > self.lease_seconds
+            except FileNotFoundError:
+                expired = True
+            if expired:
+                self._release_directory(entry.path)
+
+    def _release_directory(self, directory):
+        for entry in os.scandir(directory):
+            if not entry.is_file() or not entry.name.endswith('.pdf'):
+                continue
+            target = self._free_inbox_path(entry.name)
+            try:
+                os.rename(entry.path, target)
+            except FileNotFoundError:
+                # Another instance recovered it first
+                continue
+            pub.sendMessage('log_event', message=f"Recovered orphaned claim {entry.path} -> {target}")
+
+        try:
+            os.remove(os.path.join(directory, LEASE_FILE))
+        except FileNotFoundError:
+            pass
+        try:
+            os.rmdir(directory)
+        except OSError:
+            # Not empty yet, or the owner came back; the next round tries again
+            pass
+
+    def _free_inbox_path(self, name):
+        return self._free_path(self.inbox, name, "recovered")
+
+    @staticmethod
+    def _free_path(directory, name, suffix):
+        target = os.path.join(directory, name)
+        stem, extension = os.path.splitext(name)
+        counter = 1
+        while os.path.exists(target):
+            target = os.path.join(directory, f"{stem}_{suffix}{counter}{extension}")
+            counter += 1
+        return target
+
+    def _lease_held_by_other(self):
+        try:
+            with open(self.lease_path, encoding='utf-8') as f:
+                owner = f.read().strip()
+            age = time.time() - os.stat(self.lease_path).st_mtime
+        except FileNotFoundError:
+            return False
+        return owner != self.token and age <= self.lease_seconds
+
+    def _renew(self):
+        """Refresh the lease and return its modification time as stamped by the filesystem"""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lease_path, 'w', encoding='utf-8') as f:
+            f.write(self.token)
+        return os.stat(self.lease_path).st_mtime
+
+    def _heartbeat(self):
+        while not self.stop_event.wait(self.lease_seconds / 3):
+            try:
+                self.recover_orphans()
+            except OSError as e:
+                pub.sendMessage('log_event', message=f"Error renewing inbox lease: {e}", level=WARNING)
@@ -1,77 +1,222 @@
+import errno
 import os
 import shutil
+import tempfile
+import threading
+import time
 from pubsub import pub
 from config import Config
+from app.src.log_events import ERROR, WARNING
+from app.src.cache import get_result_cache, hash_file
 from app.src.folder_application import FolderManager
-from app.src.pdf_processor import PDFProcessor
+from app.src.llm_client import estimate_tokens
+from app.src.metrics import metrics
+from app.src.pdf_processor import PDFProcessor, RenderError, header_stats
+from app.src.pre_extractor import PreExtractor
+from app.src.separator import DocumentSeparator
 from app.src.worker_manager import WorkerManager
 
 
+def move_file(source, destination):
+    """Move source to destination so that a crash never leaves a half-written destination.
+
+    Safe to repeat: when the source is gone and the destination exists, the move already happened.
+    """
+    if not os.path.exists(source) and os.path.exists(destination):
+        return
+
+    try:
+        # Atomic on the same filesystem
+        os.replace(source, destination)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    # Across filesystems: copy under a temporary name, then rename it into place
+    temporary = destination + ".part"
+    shutil.copy2(source, temporary)
+    with open(temporary, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(temporary, destination)
+    os.remove(source)
+
+
 class CoreApplication:
-    def __init__(self, openai_api_key, language, csv_dir, output_dir):
+    def __init__(self, openai_api_key, language, csv_dir, output_dir, dry_run=False):
         self.openai_api_key = openai_api_key
         self.language = language
         self.csv_dir = csv_dir
         self.output_dir = output_dir
+        # In a dry run every stage runs, but no file is copied, moved or removed
+        self.dry_run = dry_run
+        self.worker_manager = WorkerManager(csv_dir)
+        # Shares the recipient index so the pre-extractor matches against the same names as routing
+        self.pdf_processor = PDFProcessor(language, openai_api_key, csv_dir, self.worker_manager.index)
+        # Kept for the application's lifetime so the receiver folder index survives between letters
+        self.folder_manager = FolderManager(output_dir)
+        # Destinations handed out but not yet moved to, so two letters with the same details get different names
+        self.output_path_lock = threading.Lock()
+        self.reserved_output_paths = set()
+        self.separator = None
+        if Config.settings.split_enabled:
+            settings = Config.settings
+            self.separator = DocumentSeparator(PreExtractor(self.worker_manager.index, settings.pre_extract_fuzzy_threshold,
+                                                            settings.pre_extract_subject_confidence))
 
-    def run(self, pdf_path):
-        images = self.convert_pdf_to_images(pdf_path)
-        if not images:
-            return
+    def analyze_header(self, pdf_path):
+        """Try to extract the letter details from the page 1 header alone.
 
-        ocr_text = self.perform_ocr(images)
-        if not ocr_text:
-            return
+        Returns None when the caller should fall back to OCR of the full document.
+        """
+        try:
+            header_text, confidence, page_count, area = self.pdf_processor.ocr_header(pdf_path)
+        except Exception as e:
+            pub.sendMessage('log_event', message=f"Header OCR failed, reading the full document: {e}", level=WARNING)
+            header_stats.record_escalated()
+            return None
 
-        letter_details = self.analyze_text(ocr_text)
-        if not letter_details:
-            return
+        if confidence < Config.settings.roi_min_confidence:
+            pub.sendMessage('log_event', message=f"Header OCR confidence {confidence:.0f} too low, reading the full document")
+            header_stats.record_escalated()
+            return None
 
-        worker_name, csv_filename, matched_receiver = self.find_worker(letter_details)
-        if not worker_name:
-            return
+        letter_details = self.analyze_text(header_text)
+        missing = [field for field in Config.settings.roi_required_fields
+                   if not letter_details or not getattr(letter_details, field, None)]
+        if missing:
+            pub.sendMessage('log_event', message=f"Header lacks {', '.join(missing)}, reading the full document")
+            header_stats.record_escalated()
+            return None
 
-        self.save_pdf_to_folder(pdf_path, letter_details, worker_name, matched_receiver)
+        worker_name, _, _ = self.worker_manager.find_worker_by_receiver(letter_details.receiver)
+        if not worker_name and not letter_details.responsible_person:
+            pub.sendMessage('log_event', message=f"Header receiver {letter_details.receiver} is unknown, reading the full document")
+            header_stats.record_escalated()
+            return None
 
-    def convert_pdf_to_images(self, pdf_path):
-        pdf_processor = PDFProcessor(self.language, self.openai_api_key, self.csv_dir)
-        failed_folder = os.path.join(self.output_dir, Config.settings.unrecognized_dir)
-        os.makedirs(failed_folder, exist_ok=True)
-        original_pdf_name = os.path.basename(pdf_path)
+        # The full prompt is estimated by scaling the header text to every page
+        prompt_tokens = estimate_tokens(header_text)
+        full_prompt_tokens = int(prompt_tokens * page_count / max(area, 0.01))
+        header_stats.record_resolved(prompt_tokens, full_prompt_tokens)
+        pub.sendMessage('log_event', message=(
+            f"Resolved from the header: ~{prompt_tokens} prompt tokens instead of ~{full_prompt_tokens}"
+        ))
+        return letter_details
+
+    def split_parts_dir(self, pdf_path):
+        # A dry run leaves the input folder untouched, so the parts go to a scratch directory
+        if self.dry_run:
+            return tempfile.mkdtemp(prefix="lettereye-split-")
+        return os.path.join(os.path.dirname(pdf_path), Config.settings.split_dir_name)
+
+    def split_document(self, pdf_path, parts_dir):
+        """Write every letter of a scanner batch to parts_dir and return their paths; [] for a single letter"""
+        # Timed by hand: metrics.timed would count the [] of every ordinary single letter as a failure
+        started = time.perf_counter()
+        try:
+            text_layer = self.pdf_processor.extract_text_layer(pdf_path) if Config.settings.text_layer_enabled else {}
+            documents = self.separator.find_documents(pdf_path, text_layer)
+            if len(documents) < 2:
+                return []
+
+            os.makedirs(parts_dir, exist_ok=True)
+            parts = self.separator.write_parts(pdf_path, documents, parts_dir)
+        except Exception as e:
+            metrics.inc("stage_errors_total", stage="split_document")
+            pub.sendMessage('log_event', message=f"Could not split {pdf_path}, processing it as one letter: {e}", level=WARNING)
+            return []
+        finally:
+            metrics.observe("stage_seconds", time.perf_counter() - started, stage="split_document")
+
+        metrics.inc("documents_split_total")
+        metrics.inc("split_parts_total", len(parts))
+        ranges = ", ".join(f"{first}-{last}" for first, last in documents)
+        pub.sendMessage('log_event', message=f"Split {os.path.basename(pdf_path)} into {len(parts)} letters (pages {ranges})")
+        return parts
+
+    def archive_split_original(self, pdf_path):
+        """Move a batch whose letters were written out of the inbox; returns its new path, or None"""
+        if self.dry_run:
+            return None
+        if not Config.settings.split_originals_dir:
+            os.remove(pdf_path)
+            return None
 
+        folder = os.path.join(self.output_dir, Config.settings.split_originals_dir)
+        os.makedirs(folder, exist_ok=True)
+        stem, extension = os.path.splitext(os.path.basename(pdf_path))
+        target = os.path.join(folder, stem + extension)
+        counter = 1
+        while os.path.exists(target):
+            target = os.path.join(folder, f"{stem}_{counter}{extension}")
+            counter += 1
+        move_file(pdf_path, target)
+        return target
+
+    def hash_document(self, pdf_path):
+        """The hash that keys the result cache, or None when there is no cache to look in"""
+        if not get_result_cache():
+            return None
+
+        try:
+            return hash_file(pdf_path)
+        except OSError as e:
+            pub.sendMessage('log_event', message=f"Failed to hash {pdf_path}, its results are not cached: {e}", level=WARNING)
+            return None
+
+    @metrics.timed("convert_pdf_to_images")
+    def convert_pdf_to_images(self, pdf_path, file_hash=None):
+        """Open the document and return its pages as a lazy iterator.
+
+        Only the page count and text layer are read here; the pages are rasterized
+        while the OCR stage consumes them, which rasterize_page_seconds times.
+        """
         try:
-            return pdf_processor.convert_pdf_to_images(pdf_path)
+            metrics.inc("input_bytes_total", os.path.getsize(pdf_path))
+            return self.pdf_processor.convert_pdf_to_images(pdf_path, file_hash)
         except Exception as e:
-            pub.sendMessage('log_event', message=f"Failed to convert PDF to images: {e}")
-            failed_path = os.path.join(failed_folder, original_pdf_name)
-            pdf_processor.save_pdf([], failed_path)
+            pub.sendMessage('log_event', message=f"Failed to convert PDF to images: {e}", level=ERROR)
+            self.copy_to_unrecognized(pdf_path)
             return None
 
-    def perform_ocr(self, images):
-        pdf_processor = PDFProcessor(self.language, self.openai_api_key, self.csv_dir)
+    def copy_to_unrecognized(self, pdf_path):
+        if self.dry_run or not os.path.exists(pdf_path):
+            return
+        failed_folder = os.path.join(self.output_dir, Config.settings.unrecognized_dir)
+        os.makedirs(failed_folder, exist_ok=True)
+        shutil.copy2(pdf_path, os.path.join(failed_folder, os.path.basename(pdf_path)))
+
+    @metrics.timed("perform_ocr")
+    def perform_ocr(self, pages, file_hash=None):
         try:
-            ocr_text = pdf_processor.perform_ocr(images)
+            ocr_text = self.pdf_processor.perform_ocr(pages, file_hash)
             pub.sendMessage('print_event', message="OCR Text: " + ocr_text)
             return ocr_text
+        except RenderError as e:
+            # Rendering is deferred to this stage, but a page poppler cannot read is still a conversion failure
+            pub.sendMessage('log_event', message=f"Failed to convert PDF to images: {e}", level=ERROR)
+            self.copy_to_unrecognized(e.pdf_path)
+            return None
         except Exception as e:
-            pub.sendMessage('log_event', message=f"OCR failed: {e}")
+            pub.sendMessage('log_event', message=f"OCR failed: {e}", level=ERROR)
             return None
 
+    @metrics.timed("analyze_text")
     def analyze_text(self, ocr_text):
-        pdf_processor = PDFProcessor(self.language, self.openai_api_key, self.csv_dir)
         try:
-            letter_details = pdf_processor.analyze_text(ocr_text)
+            letter_details = self.pdf_processor.analyze_text(ocr_text)
             pub.sendMessage('log_event', message="Extracted Details:")
             pub.sendMessage('log_event', message=str(letter_details))
             return letter_details
         except Exception as e:
-            pub.sendMessage('log_event', message=f"Failed to extract letter details: {e}")
+            pub.sendMessage('log_event', message=f"Failed to extract letter details: {e}", level=ERROR)
             return None
 
+    @metrics.timed("find_worker")
     def find_worker(self, letter_details):
         receiver_name = letter_details.receiver
-        worker_manager = WorkerManager(self.csv_dir)
-        worker_name, csv_filename, matched_receiver = worker_manager.find_worker_by_receiver(receiver_name)
+        worker_name, csv_filename, matched_receiver = self.worker_manager.find_worker_by_receiver(receiver_name)
 
         pub.sendMessage('log_event', message=f"Receiver: {receiver_name}")
         pub.sendMessage('log_event', message=f"Matched Receiver: {matched_receiver}")
@@ -84,35 +229,66 @@ class CoreApplication:
                 csv_filename = f"{worker_name}.csv"
             else:
                 pub.sendMessage('log_event', message=f"Receiver {receiver_name} not found in any CSV files.")
+                metrics.inc("receivers_unmatched_total")
                 return Config.settings.unrecognized_dir, None, letter_details.receiver or Config.settings.unknown_dir
 
         return worker_name, csv_filename, matched_receiver
 
-    def save_pdf_to_folder(self, pdf_path, letter_details, worker_name, matched_receiver):
-        pdf_processor = PDFProcessor(self.language, self.openai_api_key, self.csv_dir)
-        failed_folder = os.path.join(self.output_dir, Config.settings.failed_dir)
-        os.makedirs(failed_folder, exist_ok=True)
-        original_pdf_name = os.path.basename(pdf_path)
-
+    @metrics.timed("resolve_output_path")
+    def resolve_output_path(self, pdf_path, letter_details, worker_name, matched_receiver):
         try:
-            folder_manager = FolderManager(self.output_dir)
-            receiver_folder = folder_manager.find_or_create_folder(worker_name, matched_receiver)
+            receiver_folder = self.folder_manager.find_or_create_folder(worker_name, matched_receiver, create=not self.dry_run)
             date_received = letter_details.date_of_writing
             organization = letter_details.organisation or "Private"
             worker = worker_name
             letter_type = letter_details.type_of_letter
 
             filename = f"{date_received}_{organization}_{worker}_{letter_type}.pdf".replace(' ', '_').replace('/', '-').replace('\\', '-')
-            pdf_output_path = os.path.join(receiver_folder, filename)
-            
-            # Copy the original PDF to the new location
-            shutil.copy2(pdf_path, pdf_output_path)
-            pub.sendMessage('log_event', message=f"PDF saved to: {pdf_output_path}")
+            return self._free_output_path(receiver_folder, filename)
+        except Exception as e:
+            pub.sendMessage('log_event', message=f"Failed to save PDF to structured folder: {e}", level=ERROR)
+            self.copy_to_failed(pdf_path)
+            return None
 
+    def _free_output_path(self, folder, filename):
+        """The path for filename in folder, with a counter added if a letter already has or will get that name"""
+        stem, extension = os.path.splitext(filename)
+        path = os.path.join(folder, filename)
+        counter = 1
+        with self.output_path_lock:
+            while path in self.reserved_output_paths or os.path.exists(path):
+                path = os.path.join(folder, f"{stem}_{counter}{extension}")
+                counter += 1
+            self.reserved_output_paths.add(path)
+        return path
 
-            # Delete the original PDF if saved successfully
-            os.remove(pdf_path)
+    def reserve_output_path(self, path):
+        with self.output_path_lock:
+            self.reserved_output_paths.add(path)
+
+    @metrics.timed("save_pdf_to_folder")
+    def move_pdf(self, pdf_path, pdf_output_path):
+        if self.dry_run:
+            # The reservation is kept, so the dry run reports the names a real run would use
+            pub.sendMessage('log_event', message=f"Dry run, would save PDF to: {pdf_output_path}")
+            return pdf_output_path
+
+        try:
+            move_file(pdf_path, pdf_output_path)
+            pub.sendMessage('log_event', message=f"PDF saved to: {pdf_output_path}")
+            return pdf_output_path
         except Exception as e:
-            pub.sendMessage('log_event', message=f"Failed to save PDF to structured folder: {e}")
-            failed_path = os.path.join(failed_folder, original_pdf_name)
-            shutil.copy2(pdf_path, failed_path)
\ No newline at end of file
+            pub.sendMessage('log_event', message=f"Failed to save PDF to structured folder: {e}", level=ERROR)
+            self.copy_to_failed(pdf_path)
+            return None
+        finally:
+            # Once moved, the file on disk keeps the name taken
+            with self.output_path_lock:
+                self.reserved_output_paths.discard(pdf_output_path)
+
+    def copy_to_failed(self, pdf_path):
+        if self.dry_run or not os.path.exists(pdf_path):
+            return
+        failed_folder = os.path.join(self.output_dir, Config.settings.failed_dir)
+        os.makedirs(failed_folder, exist_ok=True)
+        shutil.copy2(pdf_path, os.path.join(failed_folder, os.path.basename(pdf_path)))
@@ -1,23 +1,100 @@
-from multiprocessing import process
 import os
-from fuzzywuzzy import process, fuzz
+import threading
+from rapidfuzz import process, fuzz, utils
+
+FOLDER_MATCH_THRESHOLD = 55
+
+
+class ReceiverFolders:
+    """Receiver folders of one worker folder, with normalized names and the matches already resolved"""
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.names = []
+        self.choices = []
+        self.resolved = {}
+
+    def revalidate(self):
+        """Reread the folder only when its mtime shows that something else changed it"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+
+        # Directory order is kept so that ties go to the same folder as a plain listdir scan
+        self.names = os.listdir(self.path) if mtime is not None else []
+        self.choices = [utils.default_process(name) for name in self.names]
+        self.resolved = {}
+        self.mtime = mtime
+
+    def best_match(self, receiver_name):
+        """Return (folder name, score) of the best folder scoring above the threshold, or None"""
+        if receiver_name in self.resolved:
+            return self.resolved[receiver_name]
+
+        best = None
+        query = utils.default_process(receiver_name)
+        if query and self.choices:
+            results = process.extract(query, self.choices, scorer=fuzz.ratio, processor=None,
+                                      score_cutoff=FOLDER_MATCH_THRESHOLD, limit=None)
+            for _, score, position in results:
+                rounded = int(round(score))
+                if rounded > FOLDER_MATCH_THRESHOLD and (best is None or (-rounded, position) < best):
+                    best = (-rounded, position)
+            if best:
+                best = (self.names[best[1]], -best[0])
+
+        self.resolved[receiver_name] = best
+        return best
+
+    def add(self, name):
+        """Record a folder created by this process without rereading the directory"""
+        if not name or name in self.names:
+            return
+        choice = utils.default_process(name)
+        self.names.append(name)
+        self.choices.append(choice)
+
+        # Earlier answers stay valid unless the new folder beats them
+        for receiver_name, match in self.resolved.items():
+            score = int(round(fuzz.ratio(utils.default_process(receiver_name), choice)))
+            if score > FOLDER_MATCH_THRESHOLD and (match is None or score > match[1]):
+                self.resolved[receiver_name] = (name, score)
+
+        try:
+            self.mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            self.mtime = None
+
 
 class FolderManager:
+    """Finds receiver folders below output_dir; meant to live as long as the application"""
+
     def __init__(self, output_dir):
         self.output_dir = output_dir
+        self.lock = threading.Lock()
+        self.workers = {}
 
-    def find_or_create_folder(self, worker_name, receiver_name):
+    def find_or_create_folder(self, worker_name, receiver_name, create=True):
         main_folder = os.path.join(self.output_dir, worker_name)
-        os.makedirs(main_folder, exist_ok=True)
+        if create:
+            os.makedirs(main_folder, exist_ok=True)
 
-        subdirectories = os.listdir(main_folder)
-        best_match = process.extractOne(receiver_name, subdirectories, scorer=fuzz.ratio)
+        with self.lock:
+            folders = self.workers.get(worker_name)
+            if folders is None:
+                folders = self.workers[worker_name] = ReceiverFolders(main_folder)
+            folders.revalidate()
 
-        if best_match:
-            existing_folder, score = best_match
-            if score > 55:
-                return os.path.join(main_folder, existing_folder)
+            best_match = folders.best_match(receiver_name)
+            if best_match:
+                return os.path.join(main_folder, best_match[0])
 
-        receiver_folder = os.path.join(main_folder, receiver_name)
-        os.makedirs(receiver_folder, exist_ok=True)
-        return receiver_folder
+            receiver_folder = os.path.join(main_folder, receiver_name)
+            if create:
+                os.makedirs(receiver_folder, exist_ok=True)
+                folders.add(receiver_name)
+            return receiver_folder
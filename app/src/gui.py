@@ -1,7 +1,14 @@
+import logging
+import queue
+import sys
 import threading
-from tkinter import END, LEFT, X, Button, Entry, Frame, Label, Text, filedialog
+from collections import deque
+from tkinter import END, LEFT, X, Button, Entry, Frame, Label, OptionMenu, StringVar, Text, filedialog
 from pubsub import pub
 from app.src.app import Application
+from app.src.log_events import INFO, LEVEL_NAMES, TranscriptLog, level_number
+from app.src.startup import startup_profile, warm_up_in_background
+from config import Config
 
 class GUI:
     def __init__(self, master):
@@ -9,9 +16,15 @@ class GUI:
         self.thread = None
         self.stop_event = threading.Event()
 
-        pub.subscribe(self.log_message, 'log_event')
-        pub.subscribe(self.print_message, 'print_event')
+        # Worker threads only enqueue; the Tk thread drains the queue in batches
+        self.log_queue = queue.SimpleQueue()
+        self.log_lines = deque(maxlen=max(1, Config.settings.gui_log_lines))
+        self.log_level = level_number(Config.settings.log_level)
+        self.shown_lines = 0
 
+        pub.subscribe(self.log_message, 'log_event')
+        # Full OCR transcripts go to a rotating file, not the log view
+        self.transcript_log = TranscriptLog()
 
         self.label_folder = Label(master, text="Folder to Watch:")
         self.label_folder.pack()
@@ -40,9 +53,31 @@ class GUI:
         self.start_button = Button(master, text="Start", command=self.start_process)
         self.start_button.pack()
 
+        self.frame_level = Frame(master)
+        self.frame_level.pack(fill=X)
+        Label(self.frame_level, text="Log level:").pack(side=LEFT)
+        self.level_choice = StringVar(master, value=logging.getLevelName(self.log_level))
+        self.level_menu = OptionMenu(self.frame_level, self.level_choice, *LEVEL_NAMES, command=self.set_log_level)
+        self.level_menu.pack(side=LEFT)
+
         self.log_text = Text(master, height=15, width=60)
         self.log_text.pack()
 
+        self.master.after(Config.settings.gui_log_poll_ms, self.drain_log_queue)
+
+    def on_window_shown(self):
+        startup_profile.mark("window shown")
+        if Config.settings.startup_warm_up:
+            warm_up_in_background(on_done=self.report_startup)
+        else:
+            self.report_startup()
+
+    def report_startup(self):
+        if startup_profile.enabled:
+            report = startup_profile.report()
+            print(report, file=sys.stderr)
+            self.log_message(report)
+
     def browse_folder(self):
         folder_selected = filedialog.askdirectory()
         if folder_selected:
@@ -58,9 +93,8 @@ class GUI:
     def start_process(self):
         folder_to_watch = self.entry_folder.get()
         output_path = self.entry_output.get()
-        self.log_text.insert(END, f"Watching folder: {folder_to_watch}\n")
-        self.log_text.insert(END, f"Output path: {output_path}\n")
-        self.log_text.see(END)
+        self.log_message(f"Watching folder: {folder_to_watch}")
+        self.log_message(f"Output path: {output_path}")
 
         if self.thread is None or not self.thread.is_alive():
             self.thread = threading.Thread(target=self.trigger_start_watching, args=(folder_to_watch, output_path))
@@ -73,17 +107,48 @@ class GUI:
         app = Application()
         app.start_watching(folder_to_watch, output_path, self.stop_event)
 
-    def print_message(self, message):
-        print(message)
-
     def stop_process(self):
         self.stop_event.set()
-        self.log_text.insert(END, "Stopping the process...\n")
-        self.log_text.see(END)
+        self.log_message("Stopping the process...")
         self.start_button.config(text="Start", command=self.start_process)
 
-    def log_message(self, message):
-        print(message)
-        print("_________________________________")
-        self.log_text.insert(END, message + "\n")
+    def log_message(self, message, level=INFO):
+        # Called from any thread; Tk widgets may only be touched by drain_log_queue
+        self.log_queue.put((level, message))
+
+    def drain_log_queue(self):
+        batch = []
+        try:
+            while len(batch) < Config.settings.gui_log_batch:
+                batch.append(self.log_queue.get_nowait())
+        except queue.Empty:
+            pass
+
+        if batch:
+            self.log_lines.extend(batch)
+            visible = [message for level, message in batch if level >= self.log_level]
+            if visible:
+                self.log_text.insert(END, "\n".join(visible) + "\n")
+                self.shown_lines += sum(message.count("\n") + 1 for message in visible)
+                self.trim_log_text()
+                self.log_text.see(END)
+
+        # Come back sooner while a backlog of messages is waiting
+        delay = 1 if len(batch) == Config.settings.gui_log_batch else Config.settings.gui_log_poll_ms
+        self.master.after(delay, self.drain_log_queue)
+
+    def trim_log_text(self):
+        excess = self.shown_lines - self.log_lines.maxlen
+        if excess > 0:
+            self.log_text.delete("1.0", f"{excess + 1}.0")
+            self.shown_lines -= excess
+
+    def set_log_level(self, name):
+        """Re-render the buffered messages that pass the new level"""
+        self.log_level = level_number(name)
+        visible = [message for level, message in self.log_lines if level >= self.log_level]
+        self.log_text.delete("1.0", END)
+        if visible:
+            self.log_text.insert(END, "\n".join(visible) + "\n")
+        self.shown_lines = sum(message.count("\n") + 1 for message in visible)
         self.log_text.see(END)
\ No newline at end of file
@@ -0,0 +1,152 @@
+import os
+import sqlite3
+import threading
+import time
+
+from config import Config
+
+_journal = None
+_journal_lock = threading.Lock()
+
+# A job moves through these states in order; "done" and "failed" are final
+RECEIVED = "received"
+OCR_DONE = "ocr_done"
+ANALYZED = "analyzed"
+ROUTING = "routing"
+DONE = "done"
+FAILED = "failed"
+
+
+def get_job_journal():
+    """Shared journal instance, or None when journaling is disabled"""
+    global _journal
+    with _journal_lock:
+        if _journal is None and Config.settings.journal_enabled:
+            _journal = JobJournal(Config.settings.journal_path, max_age_days=Config.settings.journal_max_age_days)
+        return _journal
+
+
+class JobJournal:
+    """Durable record of each document's progress through the pipeline.
+
+    Every stage result is committed before the next stage starts, so after a
+    crash a job resumes from its last completed stage instead of repeating
+    OCR or the LLM call.
+    """
+
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path, max_age_days=0):
+        self.path = path
+        self.max_age_seconds = max_age_days * 24 * 3600
+        self.lock = threading.Lock()
+        self.finished_since_prune = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " pdf_path TEXT NOT NULL,"
+            " file_hash TEXT NOT NULL,"
+            " state TEXT NOT NULL,"
+            " ocr_text TEXT,"
+            " letter_details TEXT,"
+            " worker_name TEXT,"
+            " csv_filename TEXT,"
+            " matched_receiver TEXT,"
+            " output_path TEXT,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_path ON jobs (pdf_path)")
+        self.connection.commit()
+        self.prune()
+
+    def begin(self, pdf_path, file_hash):
+        """Return the unfinished job for this file, or a newly created one"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM jobs WHERE pdf_path = ? AND state NOT IN (?, ?) ORDER BY id",
+                (pdf_path, DONE, FAILED),
+            ).fetchall()
+
+            for row in rows:
+                if row["file_hash"] == file_hash:
+                    return dict(row)
+                # The same name now holds different content; the old entry can never complete
+                self._update(row["id"], state=FAILED, error="superseded by a new file with the same name")
+
+            now = time.time()
+            cursor = self.connection.execute(
+                "INSERT INTO jobs (pdf_path, file_hash, state, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (pdf_path, file_hash, RECEIVED, now, now),
+            )
+            self.connection.commit()
+            return dict(self.connection.execute("SELECT * FROM jobs WHERE id = ?", (cursor.lastrowid,)).fetchone())
+
+    def unfinished(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM jobs WHERE state NOT IN (?, ?) ORDER BY id", (DONE, FAILED)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+    def record_ocr(self, job_id, ocr_text):
+        self.update(job_id, state=OCR_DONE, ocr_text=ocr_text)
+
+    def record_analysis(self, job_id, letter_details_json):
+        self.update(job_id, state=ANALYZED, letter_details=letter_details_json)
+
+    def record_route(self, job_id, worker_name, csv_filename, matched_receiver, output_path):
+        self.update(job_id, state=ROUTING, worker_name=worker_name, csv_filename=csv_filename,
+                    matched_receiver=matched_receiver, output_path=output_path)
+
+    def complete(self, job_id, output_path):
+        self.finish(job_id, state=DONE, output_path=output_path)
+
+    def fail(self, job_id, error):
+        self.finish(job_id, state=FAILED, error=error)
+
+    def finish(self, job_id, **fields):
+        # The OCR text is only needed to resume; a finished job would carry it forever
+        with self.lock:
+            self._update(job_id, ocr_text=None, **fields)
+            self.finished_since_prune += 1
+            prune = self.finished_since_prune >= self.PRUNE_EVERY
+
+        if prune:
+            self.prune()
+
+    def prune(self):
+        """Delete finished jobs older than the age limit"""
+        with self.lock:
+            self.finished_since_prune = 0
+            if self.max_age_seconds > 0:
+                self.connection.execute(
+                    "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+                    (DONE, FAILED, time.time() - self.max_age_seconds),
+                )
+                self.connection.commit()
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            self._update(job_id, **fields)
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        self.connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+        self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,226 @@
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+
+from pubsub import pub
+
+from config import Config
+from app.src.log_events import DEBUG, WARNING
+from app.src.metrics import metrics
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_analysis_client(api_key):
+    """Client shared by every PDFProcessor, so HTTP connections are pooled across documents"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AnalysisClient(api_key)
+        return _client
+
+
+def estimate_tokens(text):
+    # Roughly four characters per token for English and German prose
+    return max(1, len(text) // 4)
+
+
+def is_retryable(error):
+    # Only reached after a call failed, by which time openai is loaded anyway
+    import openai
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def retry_after_seconds(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """Sliding one-minute window over requests and tokens"""
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.lock = threading.Lock()
+        self.window = deque()
+
+    def reserve(self, tokens):
+        """Record the request and return 0, or return how long to wait before asking again"""
+        with self.lock:
+            now = time.monotonic()
+            while self.window and now - self.window[0][0] >= 60:
+                self.window.popleft()
+
+            used_tokens = sum(entry[1] for entry in self.window)
+            over_requests = self.requests_per_minute > 0 and len(self.window) >= self.requests_per_minute
+            over_tokens = (self.tokens_per_minute > 0 and self.window
+                           and used_tokens + tokens > self.tokens_per_minute)
+            if over_requests or over_tokens:
+                return max(0.05, 60 - (now - self.window[0][0]))
+
+            self.window.append([now, tokens])
+            return 0
+
+    def settle(self, estimated_tokens, actual_tokens):
+        """Replace the estimate of the most recent matching reservation with the real usage"""
+        with self.lock:
+            for entry in reversed(self.window):
+                if entry[1] == estimated_tokens:
+                    entry[1] = actual_tokens
+                    return
+
+
+class AnalysisClient:
+    """One pooled chat model with a concurrency cap, rate limiting and retries"""
+
+    def __init__(self, api_key):
+        settings = Config.settings
+        self.api_key = api_key
+        # Created on the first call: langchain and openai take a long time to import
+        self.llm = None
+        self.http_client = None
+        self.http_async_client = None
+
+        self.semaphore = threading.BoundedSemaphore(max(1, settings.llm_max_concurrency))
+        self.rate_limiter = RateLimiter(settings.llm_requests_per_minute, settings.llm_tokens_per_minute)
+        self.chains = {}
+        self.chains_lock = threading.Lock()
+
+    def chain_for(self, prompt, schema):
+        """Structured-output chain for a prompt template string and schema, built once"""
+        key = (prompt, schema)
+        with self.chains_lock:
+            if key not in self.chains:
+                from langchain_core.prompts import PromptTemplate
+                llm = self._chat_model()
+                self.chains[key] = PromptTemplate.from_template(prompt) | llm.with_structured_output(schema, include_raw=True)
+            return self.chains[key]
+
+    def warm_up(self):
+        """Load the chat model ahead of the first letter, e.g. from a background thread"""
+        with self.chains_lock:
+            self._chat_model()
+
+    def _chat_model(self):
+        if self.llm is None:
+            import httpx
+            from langchain_openai import ChatOpenAI
+
+            settings = Config.settings
+            limits = httpx.Limits(
+                max_connections=settings.llm_max_concurrency,
+                max_keepalive_connections=settings.llm_max_concurrency,
+            )
+            self.http_client = httpx.Client(limits=limits, timeout=settings.llm_timeout)
+            self.http_async_client = httpx.AsyncClient(limits=limits, timeout=settings.llm_timeout)
+
+            # Retries are handled here so they share the rate limiter and show up in the metrics
+            self.llm = ChatOpenAI(
+                api_key=self.api_key,
+                model=settings.llm_model,
+                base_url=settings.openai_base_url or None,
+                max_retries=0,
+                http_client=self.http_client,
+                http_async_client=self.http_async_client,
+            )
+        return self.llm
+
+    def invoke(self, prompt, schema, inputs):
+        chain = self.chain_for(prompt, schema)
+        estimated_tokens = estimate_tokens(prompt.format(**inputs)) + Config.settings.llm_completion_token_estimate
+
+        with self.semaphore:
+            for attempt in range(Config.settings.llm_max_retries + 1):
+                delay = self.rate_limiter.reserve(estimated_tokens)
+                while delay:
+                    time.sleep(delay)
+                    delay = self.rate_limiter.reserve(estimated_tokens)
+
+                started = time.perf_counter()
+                try:
+                    response = chain.invoke(inputs)
+                except Exception as e:
+                    if not is_retryable(e) or attempt == Config.settings.llm_max_retries:
+                        self._record_error(attempt)
+                        raise
+                    time.sleep(self._backoff(attempt, e))
+                    continue
+
+                return self._finish(response, started, estimated_tokens, attempt)
+
+    async def ainvoke(self, prompt, schema, inputs):
+        chain = self.chain_for(prompt, schema)
+        estimated_tokens = estimate_tokens(prompt.format(**inputs)) + Config.settings.llm_completion_token_estimate
+
+        # The threading semaphore is shared with sync callers, so acquire it off the event loop
+        await asyncio.to_thread(self.semaphore.acquire)
+        try:
+            for attempt in range(Config.settings.llm_max_retries + 1):
+                delay = self.rate_limiter.reserve(estimated_tokens)
+                while delay:
+                    await asyncio.sleep(delay)
+                    delay = self.rate_limiter.reserve(estimated_tokens)
+
+                started = time.perf_counter()
+                try:
+                    response = await chain.ainvoke(inputs)
+                except Exception as e:
+                    if not is_retryable(e) or attempt == Config.settings.llm_max_retries:
+                        self._record_error(attempt)
+                        raise
+                    await asyncio.sleep(self._backoff(attempt, e))
+                    continue
+
+                return self._finish(response, started, estimated_tokens, attempt)
+        finally:
+            self.semaphore.release()
+
+    def _backoff(self, attempt, error):
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            # A server asking for minutes would otherwise hold a worker and a concurrency slot that long
+            delay = min(max(0.0, retry_after), Config.settings.llm_backoff_max)
+        else:
+            # Full jitter keeps concurrent workers from retrying in lockstep
+            cap = min(Config.settings.llm_backoff_max, Config.settings.llm_backoff_base * 2 ** attempt)
+            delay = random.uniform(0, cap)
+        pub.sendMessage('log_event', message=f"LLM call failed ({error}), retrying in {delay:.1f}s", level=WARNING)
+        return delay
+
+    def _finish(self, response, started, estimated_tokens, retries):
+        latency = time.perf_counter() - started
+        if response.get("parsing_error"):
+            self._record_error(retries)
+            raise response["parsing_error"]
+
+        usage = getattr(response["raw"], "usage_metadata", None) or {}
+        prompt_tokens = usage.get("input_tokens", 0)
+        completion_tokens = usage.get("output_tokens", 0)
+        if prompt_tokens or completion_tokens:
+            self.rate_limiter.settle(estimated_tokens, prompt_tokens + completion_tokens)
+
+        metrics.observe("llm_call_seconds", latency)
+        metrics.inc("llm_tokens_total", prompt_tokens, kind="prompt")
+        metrics.inc("llm_tokens_total", completion_tokens, kind="completion")
+        metrics.inc("llm_retries_total", retries)
+        pub.sendMessage('log_event', message=(
+            f"LLM call took {latency:.2f}s, {prompt_tokens} prompt / {completion_tokens} completion tokens"
+        ), level=DEBUG)
+        return response["parsed"]
+
+    def _record_error(self, retries):
+        metrics.inc("llm_errors_total")
+        metrics.inc("llm_retries_total", retries)
@@ -0,0 +1,72 @@
+"""Message topics shared by the pipeline and its front ends.
+
+The topics are declared explicitly so that 'log_event' carries an optional
+level; pubsub would otherwise infer the arguments from whichever listener or
+message comes first. Listeners must accept both arguments.
+"""
+import logging
+import os
+import sys
+from logging.handlers import RotatingFileHandler
+from pubsub import pub
+
+from config import Config
+
+DEBUG = logging.DEBUG
+INFO = logging.INFO
+WARNING = logging.WARNING
+ERROR = logging.ERROR
+
+LEVEL_NAMES = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+
+def log_event_spec(message, level=INFO):
+    """A human-readable status line"""
+
+
+def print_event_spec(message):
+    """A large text dump, such as a full OCR transcript"""
+
+
+topic_manager = pub.getDefaultTopicMgr()
+topic_manager.getOrCreateTopic('log_event', log_event_spec)
+topic_manager.getOrCreateTopic('print_event', print_event_spec)
+
+
+def level_number(name):
+    return logging.getLevelName(name.upper()) if isinstance(name, str) else name
+
+
+def print_log(message, level=INFO):
+    """'log_event' listener for the command line front ends; writes to stderr"""
+    if level >= level_number(Config.settings.log_level):
+        print(message if level == INFO else f"{logging.getLevelName(level)}: {message}", file=sys.stderr)
+
+
+class TranscriptLog:
+    """Writes 'print_event' dumps to a size-rotated file instead of the log view"""
+
+    def __init__(self):
+        settings = Config.settings
+        directory = os.path.dirname(settings.transcript_log_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.logger = logging.getLogger("lettereye.transcripts")
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        if not self.logger.handlers:
+            handler = RotatingFileHandler(
+                settings.transcript_log_path,
+                maxBytes=settings.transcript_log_max_mb * 1024 * 1024,
+                backupCount=settings.transcript_log_backups,
+                encoding='utf-8',
+                # Opened on the first transcript, so runs without any leave no empty file behind
+                delay=True,
+            )
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.logger.addHandler(handler)
+        pub.subscribe(self.write, 'print_event')
+
+    def write(self, message):
+        self.logger.info(message)
@@ -0,0 +1,238 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pubsub import pub
+
+from config import Config
+from app.src.log_events import WARNING
+
+PREFIX = "lettereye_"
+
+# Seconds; wide enough for a single fuzzy match as well as a long LLM call with retries
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def label_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{name}="{escape_label(value)}"' for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th observation"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """Counters, histograms and sampled gauges, each identified by a name and labels"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        key = label_key(labels)
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = label_key(labels)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    def gauge(self, name, callback, **labels):
+        """Register a callable sampled whenever the metrics are read"""
+        with self.lock:
+            self.gauges.setdefault(name, {})[label_key(labels)] = callback
+
+    def timed(self, stage):
+        """Decorator recording the latency of a stage, and a failure when it raises or returns nothing"""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    result = function(*args, **kwargs)
+                except Exception:
+                    self.inc("stage_errors_total", stage=stage)
+                    raise
+                finally:
+                    self.observe("stage_seconds", time.perf_counter() - started, stage=stage)
+                if not result:
+                    self.inc("stage_errors_total", stage=stage)
+                return result
+            return wrapper
+        return decorator
+
+    def _sample_gauges(self):
+        with self.lock:
+            gauges = {name: dict(series) for name, series in self.gauges.items()}
+
+        values = {}
+        for name, series in gauges.items():
+            for key, callback in series.items():
+                try:
+                    values.setdefault(name, {})[key] = callback()
+                except Exception:
+                    continue
+        return values
+
+    def snapshot(self):
+        gauges = self._sample_gauges()
+        with self.lock:
+            return {
+                "timestamp": time.time(),
+                "counters": {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                             for name, series in self.counters.items()},
+                "gauges": {name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                           for name, series in gauges.items()},
+                "histograms": {
+                    name: [{
+                        "labels": dict(key),
+                        "count": histogram.count,
+                        "sum": round(histogram.sum, 6),
+                        "p50": histogram.quantile(0.5),
+                        "p95": histogram.quantile(0.95),
+                        "buckets": dict(zip(map(str, histogram.buckets), histogram.counts)),
+                    } for key, histogram in series.items()]
+                    for name, series in self.histograms.items()
+                },
+            }
+
+    def render_prometheus(self):
+        """Text exposition format, version 0.0.4"""
+        gauges = self._sample_gauges()
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+                for key, value in series.items():
+                    lines.append(f"{PREFIX}{name}{format_labels(key)} {value}")
+
+            for name, series in sorted(gauges.items()):
+                lines.append(f"# TYPE {PREFIX}{name} gauge")
+                for key, value in series.items():
+                    lines.append(f"{PREFIX}{name}{format_labels(key)} {value}")
+
+            for name, series in sorted(self.histograms.items()):
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{PREFIX}{name}_bucket{format_labels(key, [('le', bound)])} {cumulative}")
+                    lines.append(f"{PREFIX}{name}_bucket{format_labels(key, [('le', '+Inf')])} {histogram.count}")
+                    lines.append(f"{PREFIX}{name}_sum{format_labels(key)} {histogram.sum}")
+                    lines.append(f"{PREFIX}{name}_count{format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        data = metrics.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class MetricsExporter:
+    """Serves /metrics and writes periodic JSON snapshots, as enabled in the settings"""
+
+    def __init__(self):
+        settings = Config.settings
+        self.port = settings.metrics_port
+        self.host = settings.metrics_host
+        self.snapshot_path = settings.metrics_snapshot_path
+        self.snapshot_interval = settings.metrics_snapshot_interval
+        self.server = None
+        self.stop_event = threading.Event()
+        self.snapshot_thread = None
+
+    def start(self):
+        if self.port:
+            self.server = ThreadingHTTPServer((self.host, self.port), MetricsHandler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+            pub.sendMessage('log_event', message=f"Serving metrics on http://{self.host}:{self.server.server_address[1]}/metrics")
+
+        if self.snapshot_path:
+            self.snapshot_thread = threading.Thread(target=self._write_snapshots, name="metrics-snapshot", daemon=True)
+            self.snapshot_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.snapshot_thread:
+            self.snapshot_thread.join()
+            # One last snapshot so short runs still leave their totals behind
+            self.write_snapshot()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+
+    def write_snapshot(self):
+        directory = os.path.dirname(self.snapshot_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = self.snapshot_path + ".tmp"
+        with open(temporary, 'w', encoding='utf-8') as f:
+            json.dump(metrics.snapshot(), f, indent=2)
+        # Readers never see a partially written snapshot
+        os.replace(temporary, self.snapshot_path)
+
+    def _write_snapshots(self):
+        while not self.stop_event.wait(self.snapshot_interval):
+            try:
+                self.write_snapshot()
+            except OSError as e:
+                pub.sendMessage('log_event', message=f"Failed to write metrics snapshot: {e}", level=WARNING)
@@ -9,3 +9,7 @@ class LetterDetails(BaseModel):
     date_of_writing: str = Field(..., description="The date the letter was written")
     type_of_letter: str = Field(..., description="The type of the letter. Maximal 5 words which describes a summary what the letter is about")
     responsible_person: str = Field(..., description="The person responsible for the letter. Name only (no other details)")
+
+
+class LetterSummary(BaseModel):
+    type_of_letter: str = Field(..., description="The type of the letter. Maximal 5 words which describes a summary what the letter is about")
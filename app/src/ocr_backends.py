@@ -0,0 +1,98 @@
+import threading
+from pubsub import pub
+
+from config import Config
+from app.src.log_events import WARNING
+
+_local = threading.local()
+
+
+def get_ocr_backend():
+    """OCR engine for the calling thread, created on first use.
+
+    Engines are not thread-safe, so each thread (and each OCR worker process)
+    gets its own; it then stays loaded for every later page.
+    """
+    backend = getattr(_local, "backend", None)
+    if backend is None:
+        backend = _local.backend = create_ocr_backend()
+    return backend
+
+
+def warm_up_ocr_backend():
+    """Process pool initializer: load the engine and language model before the first page arrives"""
+    get_ocr_backend()
+
+
+def create_ocr_backend():
+    settings = Config.settings
+    name = settings.ocr_backend
+    if name in ("tesserocr", "auto"):
+        try:
+            return TesserocrBackend(settings.ocr_language, settings.ocr_psm, settings.ocr_oem, settings.tessdata_path)
+        except ImportError as e:
+            if name == "tesserocr":
+                pub.sendMessage('log_event', message=f"tesserocr unavailable ({e}), falling back to pytesseract", level=WARNING)
+        except Exception as e:
+            # Installed but unable to start, e.g. missing language data; one bad engine must not stop OCR
+            pub.sendMessage('log_event', message=f"tesserocr failed to start ({e}), falling back to pytesseract", level=WARNING)
+    elif name != "pytesseract":
+        pub.sendMessage('log_event', message=f"Unknown OCR backend {name}, using pytesseract")
+    return PytesseractBackend(settings.ocr_language, settings.ocr_psm, settings.ocr_oem, settings.tessdata_path)
+
+
+class PytesseractBackend:
+    """Runs the tesseract executable for every image; works wherever tesseract is installed"""
+
+    name = "pytesseract"
+
+    def __init__(self, language, psm, oem, tessdata_path=""):
+        import pytesseract
+        self.pytesseract = pytesseract
+        self.language = language
+        self.config = f"--psm {psm} --oem {oem}"
+        if tessdata_path:
+            self.config += f' --tessdata-dir "{tessdata_path}"'
+
+    def image_to_string(self, image):
+        return self.pytesseract.image_to_string(image, lang=self.language, config=self.config)
+
+    def image_to_text_and_confidence(self, image):
+        data = self.pytesseract.image_to_data(image, lang=self.language, config=self.config,
+                                              output_type=self.pytesseract.Output.DICT)
+        lines = {}
+        confidences = []
+        for index, word in enumerate(data["text"]):
+            confidence = float(data["conf"][index])
+            if confidence < 0 or not word.strip():
+                continue
+            key = (data["block_num"][index], data["par_num"][index], data["line_num"][index])
+            lines.setdefault(key, []).append(word)
+            confidences.append(confidence)
+
+        text = "\n".join(" ".join(words) for words in lines.values())
+        return text, sum(confidences) / len(confidences) if confidences else 0.0
+
+
+class TesserocrBackend:
+    """Keeps one Tesseract API handle loaded and passes images to it in memory"""
+
+    name = "tesserocr"
+
+    def __init__(self, language, psm, oem, tessdata_path=""):
+        import tesserocr
+        # PSM and OEM are enum namespaces that cannot be instantiated; the API takes the plain ints
+        options = dict(lang=language, psm=psm, oem=oem)
+        if tessdata_path:
+            options["path"] = tessdata_path
+        # Raises RuntimeError when the language data cannot be loaded
+        self.api = tesserocr.PyTessBaseAPI(**options)
+
+    def image_to_string(self, image):
+        self.api.SetImage(image)
+        return self.api.GetUTF8Text()
+
+    def image_to_text_and_confidence(self, image):
+        self.api.SetImage(image)
+        text = self.api.GetUTF8Text()
+        return text.strip(), float(self.api.MeanTextConf())
@@ -1,43 +1,453 @@
-from langchain_openai import ChatOpenAI
-from pdf2image import convert_from_path
-import pytesseract
-from langchain import LLMChain, PromptTemplate
-from app.src.models import LetterDetails
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from pdf2image import convert_from_path, pdfinfo_from_path
+from pypdf import PdfReader
+from app.src.cache import get_result_cache, hash_image, hash_text
+from app.src.llm_client import get_analysis_client
+from app.src.metrics import metrics
+from app.src.ocr_backends import get_ocr_backend, warm_up_ocr_backend
+from app.src.preprocess import preprocess_page, preprocessing_signature
+from app.src.models import LetterDetails, LetterSummary
+from app.src.pre_extractor import PreExtractor, pre_extraction_stats
 from pubsub import pub
 import os
 
+from config import Config
+from app.src.log_events import DEBUG, ERROR
+
+# Bump whenever the analysis prompt changes so cached LetterDetails are not reused
+PROMPT_VERSION = "1"
+
+# Template strings; the LLM client turns them into langchain prompts when it first needs them
+ANALYSIS_PROMPT = (
+    """
+        From the text provided, extract the names of the sender and recipient, including only the recipient's name. Identify the date of writing and provide a type of letter classified as an ultra-short summary in a maximum of 5 words in {language}. If a responsible person, whose name maybe appears in {responsible_persons_names}, is associated with the recipient, include their name; otherwise, leave that field empty. Text: {ocr_text}
+    """
+)
+
+SUMMARY_PROMPT = (
+    """
+        Classify the type of the letter below as an ultra-short summary in a maximum of 5 words in {language}. Text: {ocr_text}
+    """
+)
+
+_ocr_executor = None
+_ocr_executor_lock = threading.Lock()
+
+
+def get_ocr_executor():
+    """Process pool shared by every document, created on first use"""
+    global _ocr_executor
+    with _ocr_executor_lock:
+        if _ocr_executor is None:
+            _ocr_executor = ProcessPoolExecutor(max_workers=max(1, Config.settings.ocr_workers),
+                                                initializer=warm_up_ocr_backend)
+        return _ocr_executor
+
+
+def shutdown_ocr_executor():
+    global _ocr_executor
+    with _ocr_executor_lock:
+        if _ocr_executor is not None:
+            _ocr_executor.shutdown()
+            _ocr_executor = None
+
+
+class RenderError(Exception):
+    """Raised while the pages are consumed when poppler cannot rasterize some of them"""
+
+    def __init__(self, pdf_path, error):
+        super().__init__(f"{os.path.basename(pdf_path)}: {error}")
+        self.pdf_path = pdf_path
+
+
+class PageSourceStats:
+    """Counts how many pages were read from the text layer versus OCR'd"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.text_layer_pages = 0
+        self.ocr_pages = 0
+
+    def record(self, text_layer_pages, ocr_pages):
+        with self.lock:
+            self.text_layer_pages += text_layer_pages
+            self.ocr_pages += ocr_pages
+        metrics.inc("pages_total", text_layer_pages, source="text_layer")
+        metrics.inc("pages_total", ocr_pages, source="ocr")
+
+    def snapshot(self):
+        with self.lock:
+            total = self.text_layer_pages + self.ocr_pages
+            return {
+                "text_layer_pages": self.text_layer_pages,
+                "ocr_pages": self.ocr_pages,
+                "text_layer_ratio": self.text_layer_pages / total if total else 0.0,
+            }
+
+
+page_source_stats = PageSourceStats()
+
+
+class HeaderStats:
+    """Outcome of the header-first pass and the prompt tokens it saved"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resolved = 0
+        self.escalated = 0
+        self.prompt_tokens = 0
+        self.full_prompt_tokens_estimate = 0
+
+    def record_resolved(self, prompt_tokens, full_prompt_tokens_estimate):
+        with self.lock:
+            self.resolved += 1
+            self.prompt_tokens += prompt_tokens
+            self.full_prompt_tokens_estimate += full_prompt_tokens_estimate
+        metrics.inc("header_pass_total", outcome="resolved")
+        metrics.inc("header_prompt_tokens_total", prompt_tokens)
+        metrics.inc("header_prompt_tokens_saved_total", max(0, full_prompt_tokens_estimate - prompt_tokens))
+
+    def record_escalated(self):
+        with self.lock:
+            self.escalated += 1
+        metrics.inc("header_pass_total", outcome="escalated")
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "resolved": self.resolved,
+                "escalated": self.escalated,
+                "prompt_tokens": self.prompt_tokens,
+                "prompt_tokens_saved_estimate": self.full_prompt_tokens_estimate - self.prompt_tokens,
+            }
+
+
+header_stats = HeaderStats()
+
+
+def is_usable_text(text):
+    settings = Config.settings
+    characters = "".join(text.split())
+    if len(characters) < settings.text_layer_min_chars:
+        return False
+    # Scanned PDFs with a junk text layer tend to be dominated by symbols and stray glyphs
+    alphanumeric = sum(1 for character in characters if character.isalnum())
+    return alphanumeric / len(characters) >= settings.text_layer_min_quality
+
+
+def ocr_region(image):
+    """OCR a cropped region, returning its text and the mean word confidence"""
+    return get_ocr_backend().image_to_text_and_confidence(image)
+
+
+def ocr_page(image):
+    """Return (text, OCR seconds, {preprocessing step: seconds}); text is None for a blank page"""
+    preprocess_timings = {}
+    if Config.settings.preprocess_enabled:
+        image, preprocess_timings = preprocess_page(image)
+        if image is None:
+            return None, 0.0, preprocess_timings
+
+    started = time.perf_counter()
+    text = get_ocr_backend().image_to_string(image)
+    return text, time.perf_counter() - started, preprocess_timings
+
+
+def ocr_signature():
+    """Settings that change the text OCR produces for the same page image"""
+    settings = Config.settings
+    return f"{preprocessing_signature()}|{settings.ocr_language}:{settings.ocr_psm}:{settings.ocr_oem}"
+
+
+def page_cache_key(image):
+    # The same page gives different text once preprocessing or Tesseract options change
+    return hash_text(hash_image(image), ocr_signature())
+
+
+def document_cache_key(file_hash):
+    settings = Config.settings
+    # Besides OCR, rendering and the choice between text layer and OCR decide a document's text
+    return hash_text(file_hash, ocr_signature(),
+                     f"{settings.raster_dpi}:{settings.raster_grayscale}",
+                     f"{settings.text_layer_enabled}:{settings.text_layer_min_chars}:{settings.text_layer_min_quality}")
+
+
 class PDFProcessor:
-    def __init__(self, language, api_key, csv_dir):
+    def __init__(self, language, api_key, csv_dir, recipient_index=None):
+        settings = Config.settings
         self.language = language
-        self.llm = ChatOpenAI(api_key=api_key, model="gpt-4o")
+        self.client = get_analysis_client(api_key)
         self.csv_dir = csv_dir
+        self.csv_dir_mtime = None
+        self.responsible_persons_names = None
+        self.pre_extractor = None
+        if settings.pre_extract_enabled and recipient_index is not None:
+            self.pre_extractor = PreExtractor(recipient_index, settings.pre_extract_fuzzy_threshold,
+                                              settings.pre_extract_subject_confidence)
+
+    def convert_pdf_to_images(self, pdf_path, file_hash=None):
+        cache = get_result_cache()
+        if cache and file_hash:
+            cached_text = cache.get("document", document_cache_key(file_hash))
+            if cached_text is not None:
+                pub.sendMessage('log_event', message=f"Reusing cached OCR text for {os.path.basename(pdf_path)}")
+                return iter([cached_text])
+
+        text_layer = self.extract_text_layer(pdf_path) if Config.settings.text_layer_enabled else {}
+
+        # Reading the page count up front still rejects broken PDFs before any rendering happens
+        page_count = pdfinfo_from_path(pdf_path)["Pages"]
+
+        page_source_stats.record(len(text_layer), page_count - len(text_layer))
+        if text_layer:
+            pub.sendMessage('log_event', message=f"Text layer used for {len(text_layer)}/{page_count} pages, OCR for the rest")
+        return self.iter_pages(pdf_path, page_count, text_layer)
+
+    def extract_text_layer(self, pdf_path, last_page=None):
+        """Return {page_number: text} for the pages whose embedded text is good enough to skip OCR"""
+        try:
+            reader = PdfReader(pdf_path)
+            page_texts = {}
+            for page_number, page in enumerate(reader.pages[:last_page], start=1):
+                text = page.extract_text() or ""
+                if is_usable_text(text):
+                    page_texts[page_number] = text + "\n"
+            return page_texts
+        except Exception as e:
+            pub.sendMessage('log_event', message=f"Could not read text layer, falling back to OCR: {e}")
+            return {}
+
+    def iter_pages(self, pdf_path, page_count, text_layer=None):
+        """Yield each page in order: embedded text as str, otherwise a rendered image.
+
+        Pages that need OCR are rendered a small window at a time.
+        """
+        text_layer = text_layer or {}
+        window = max(1, Config.settings.raster_window)
+
+        page_number = 1
+        while page_number <= page_count:
+            if page_number in text_layer:
+                yield text_layer[page_number]
+                page_number += 1
+                continue
+
+            last_page = page_number
+            while (last_page - page_number + 1 < window and last_page < page_count
+                   and last_page + 1 not in text_layer):
+                last_page += 1
+
+            yield from self._render_pages(pdf_path, page_number, last_page)
+            page_number = last_page + 1
+
+    def _render_pages(self, pdf_path, first_page, last_page):
+        settings = Config.settings
+        options = dict(
+            dpi=settings.raster_dpi,
+            grayscale=settings.raster_grayscale,
+            thread_count=settings.raster_thread_count,
+            first_page=first_page,
+            last_page=last_page,
+        )
+
+        started = time.perf_counter()
+        if settings.raster_to_disk:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                images = self._rasterize(pdf_path, output_folder=temp_dir, **options)
+                for image in images:
+                    # Load before the temp directory is removed; the file handle is released here
+                    image.load()
+                self._record_render(started, images)
+                yield from images
+        else:
+            images = self._rasterize(pdf_path, **options)
+            self._record_render(started, images)
+            yield from images
+
+    @staticmethod
+    def _rasterize(pdf_path, **options):
+        try:
+            return convert_from_path(pdf_path, **options)
+        except Exception as e:
+            raise RenderError(pdf_path, e) from e
+
+    def _record_render(self, started, images):
+        elapsed = time.perf_counter() - started
+        for _ in images:
+            metrics.observe("rasterize_page_seconds", elapsed / len(images))
+
+    def ocr_header(self, pdf_path):
+        """Read only the configured header/address regions of page 1.
 
-    def convert_pdf_to_images(self, pdf_path):
-        return convert_from_path(pdf_path)
+        Returns (text, mean confidence, page count, fraction of the page covered).
+        """
+        settings = Config.settings
+        page_count = pdfinfo_from_path(pdf_path)["Pages"]
+        regions = settings.roi_regions
+        area = sum((right - left) * (bottom - top) for left, top, right, bottom in regions)
 
-    def perform_ocr(self, images):
-        ocr_text = ""
-        for image in images:
-            ocr_text += pytesseract.image_to_string(image)
+        text_layer = self.extract_text_layer(pdf_path, last_page=1) if settings.text_layer_enabled else {}
+        if 1 in text_layer:
+            # Cropping embedded text by region is not worth it; page 1 is already cheap to send
+            return text_layer[1], 100.0, page_count, 1.0
+
+        page = next(self._render_pages(pdf_path, 1, 1))
+        width, height = page.size
+        texts = []
+        confidences = []
+        for left, top, right, bottom in regions:
+            crop = page.crop((int(left * width), int(top * height), int(right * width), int(bottom * height)))
+            text, confidence = ocr_region(crop)
+            texts.append(text)
+            confidences.append(confidence)
+
+        return "\n".join(texts), min(confidences, default=0.0), page_count, area
+
+    def perform_ocr(self, pages, file_hash=None):
+        settings = Config.settings
+        cache = get_result_cache()
+        page_texts = []
+
+        if settings.parallel_ocr:
+            executor = get_ocr_executor()
+            # Bounding the pages in flight keeps memory independent of the document length
+            max_in_flight = max(settings.raster_window, settings.ocr_workers, 1)
+            in_flight = deque()
+            for page in pages:
+                in_flight.append(self._start_page(page, cache, executor))
+                if len(in_flight) >= max_in_flight:
+                    page_texts.append(self._collect_page(in_flight.popleft(), len(page_texts) + 1, cache))
+            while in_flight:
+                page_texts.append(self._collect_page(in_flight.popleft(), len(page_texts) + 1, cache))
+        else:
+            for page in pages:
+                page_texts.append(self._collect_page(self._start_page(page, cache), len(page_texts) + 1, cache))
+
+        ocr_text = "".join(page_texts)
+        if cache and file_hash:
+            cache.put("document", document_cache_key(file_hash), ocr_text)
         return ocr_text
 
-    def save_pdf(self, images, save_path):
-        images[0].save(save_path, save_all=True, append_images=images[1:])
-        pub.sendMessage('log_event', message=f"PDF saved to: {save_path}")
+    def _start_page(self, page, cache, executor=None):
+        """Return (page_hash, result): result is ready text, a pending Future or an OCR result"""
+        if isinstance(page, str):
+            # Text layer or cached document text
+            return None, page
+
+        page_hash = page_cache_key(page) if cache else None
+        if page_hash:
+            cached_text = cache.get("page", page_hash)
+            if cached_text is not None:
+                return None, cached_text
+
+        return page_hash, executor.submit(ocr_page, page) if executor else ocr_page(page)
+
+    def _collect_page(self, started_page, page_number, cache):
+        page_hash, result = started_page
+        if isinstance(result, Future):
+            result = result.result()
+        if isinstance(result, str):
+            return result
+
+        text, elapsed, preprocess_timings = result
+        for step, seconds in preprocess_timings.items():
+            metrics.observe("preprocess_seconds", seconds, step=step)
+        preprocessing = sum(preprocess_timings.values())
+        if text is None:
+            text = ""
+            metrics.inc("pages_blank_total")
+            pub.sendMessage('log_event', message=f"Page {page_number} is blank, skipped OCR")
+        else:
+            pub.sendMessage('log_event', message=(
+                f"OCR page {page_number} took {elapsed:.2f}s" + (f" after {preprocessing:.2f}s preprocessing" if preprocess_timings else "")
+            ), level=DEBUG)
+            metrics.observe("ocr_page_seconds", elapsed)
+        if page_hash:
+            cache.put("page", page_hash, text)
+        return text
+
+    def get_responsible_persons_names(self):
+        # The caseworker list only changes when a CSV is added or removed, which bumps the directory mtime
+        mtime = os.stat(self.csv_dir).st_mtime_ns
+        if mtime != self.csv_dir_mtime:
+            self.responsible_persons_names = str(os.listdir(self.csv_dir))
+            self.csv_dir_mtime = mtime
+        return self.responsible_persons_names
 
     def analyze_text(self, ocr_text):
         try:
-            prompt_template = (
-                """
-                    From the text provided, extract the names of the sender and recipient, including only the recipient's name. Identify the date of writing and provide a type of letter classified as an ultra-short summary in a maximum of 5 words in {language}. If a responsible person, whose name maybe appears in {responsible_persons_names}, is associated with the recipient, include their name; otherwise, leave that field empty. Text: {ocr_text}
-                """
-            )
-
-            llm_with_structured_output = self.llm.with_structured_output(LetterDetails)
-            prompt = PromptTemplate(template=prompt_template, input_variables=["ocr_text", "language"])
-            chain = prompt | llm_with_structured_output
-            response = chain.invoke({"ocr_text": ocr_text, "language": self.language, "responsible_persons_names": str(os.listdir(self.csv_dir))})
-            return response
+            extraction = self.pre_extractor.extract(ocr_text) if self.pre_extractor else None
+            if extraction:
+                min_confidence = Config.settings.pre_extract_min_confidence
+                fields = list(Config.settings.pre_extract_required_fields) + ["type_of_letter"]
+                uncertain = extraction.uncertain_fields(min_confidence, fields)
+                if not uncertain:
+                    return self._pre_extracted(extraction, "skipped", extraction.letter_details())
+                if uncertain == ["type_of_letter"]:
+                    letter_details = extraction.letter_details(type_of_letter=self.summarize_text(ocr_text))
+                    return self._pre_extracted(extraction, "summary_only", letter_details)
+
+            letter_details = self.extract_details(ocr_text)
+            if extraction:
+                letter_details = extraction.merge(letter_details, min_confidence)
+                self._pre_extracted(extraction, "full", letter_details)
+            return letter_details
         except Exception as e:
-            pub.sendMessage('log_event', message=f"Failed to analyze text: {e}")
-            raise
\ No newline at end of file
+            pub.sendMessage('log_event', message=f"Failed to analyze text: {e}", level=ERROR)
+            raise
+
+    def _pre_extracted(self, extraction, outcome, letter_details):
+        pre_extraction_stats.record(outcome)
+        skip_rate = pre_extraction_stats.snapshot()["llm_skip_rate"]
+        pub.sendMessage('log_event', message=(
+            f"Pre-extraction {outcome}: {extraction.describe()} (LLM skipped for {skip_rate:.0%} of letters)"
+        ), level=DEBUG)
+        return letter_details
+
+    def extract_details(self, ocr_text):
+        responsible_persons_names = self.get_responsible_persons_names()
+
+        cache = get_result_cache()
+        cache_key = None
+        if cache:
+            normalized_text = " ".join(ocr_text.split())
+            cache_key = hash_text(PROMPT_VERSION, self.language, responsible_persons_names, normalized_text)
+            cached_details = cache.get("analysis", cache_key)
+            if cached_details is not None:
+                pub.sendMessage('log_event', message="Reusing cached letter details")
+                return LetterDetails.model_validate_json(cached_details)
+
+        response = self.client.invoke(ANALYSIS_PROMPT, LetterDetails, {
+            "ocr_text": ocr_text,
+            "language": self.language,
+            "responsible_persons_names": responsible_persons_names,
+        })
+
+        if cache_key:
+            cache.put("analysis", cache_key, response.model_dump_json())
+        return response
+
+    def summarize_text(self, ocr_text):
+        """Ask the LLM for type_of_letter alone, from the start of the letter"""
+        text = ocr_text[:Config.settings.pre_extract_summary_chars]
+
+        cache = get_result_cache()
+        cache_key = None
+        if cache:
+            cache_key = hash_text(PROMPT_VERSION, self.language, " ".join(text.split()))
+            cached_summary = cache.get("summary", cache_key)
+            if cached_summary is not None:
+                return cached_summary
+
+        response = self.client.invoke(SUMMARY_PROMPT, LetterSummary, {
+            "ocr_text": text,
+            "language": self.language,
+        })
+
+        if cache_key:
+            cache.put("summary", cache_key, response.type_of_letter)
+        return response.type_of_letter
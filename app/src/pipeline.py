@@ -0,0 +1,411 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from pubsub import pub
+
+from config import Config
+from app.src.cache import hash_file
+from app.src.log_events import ERROR
+from app.src import journal as job_states
+from app.src.journal import get_job_journal
+from app.src.metrics import metrics
+from app.src.models import LetterDetails
+from app.src.pdf_processor import shutdown_ocr_executor
+
+
+# Lower values are served first at every stage, so live arrivals overtake the backlog
+LIVE = 0
+BACKLOG = 1
+STOP = 2
+
+
+class Job:
+    def __init__(self, pdf_path, priority=LIVE):
+        self.pdf_path = pdf_path
+        self.priority = priority
+        self.admission = None
+        self.file_hash = None
+        self.pages = None
+        self.ocr_text = None
+        self.letter_details = None
+        self.worker_name = None
+        self.csv_filename = None
+        self.matched_receiver = None
+        self.output_path = None
+        self.failed_stage = None
+        self.error = None
+        self.timings = {}
+        self.journal_id = None
+        # Set when the job was a scanner batch, whose letters continue as jobs of their own
+        self.parts = None
+        self.submitted_at = time.monotonic()
+
+    def restore(self, entry):
+        """Pick up whatever an earlier, interrupted run already completed for this file"""
+        self.journal_id = entry["id"]
+        self.ocr_text = entry["ocr_text"]
+        if entry["letter_details"]:
+            self.letter_details = LetterDetails.model_validate_json(entry["letter_details"])
+        if entry["state"] == job_states.ROUTING:
+            self.worker_name = entry["worker_name"]
+            self.csv_filename = entry["csv_filename"]
+            self.matched_receiver = entry["matched_receiver"]
+            self.output_path = entry["output_path"]
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+class BacklogProgress:
+    def __init__(self, total, interval):
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.started_at = time.monotonic()
+        self.last_report = self.started_at
+        self.lock = threading.Lock()
+
+    def add(self, count):
+        """Account for letters split out of a backlog batch"""
+        with self.lock:
+            self.total += count
+
+    def record_done(self):
+        with self.lock:
+            self.done += 1
+            now = time.monotonic()
+            if now - self.last_report < self.interval and self.done < self.total:
+                return
+            self.last_report = now
+            done, total, elapsed = self.done, self.total, now - self.started_at
+
+        rate = done / elapsed if elapsed else 0.0
+        eta = format_duration((total - done) / rate) if rate else "unknown"
+        pub.sendMessage('log_event', message=(
+            f"Backlog: {done}/{total} done ({done * 100 // max(total, 1)}%), "
+            f"{rate * 60:.1f} docs/min, ETA {eta}"
+        ))
+
+
+class Stage:
+    """A bounded priority queue drained by a fixed pool of worker threads"""
+
+    sequence = itertools.count()
+
+    def __init__(self, name, handler, workers, queue_size):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue = queue.PriorityQueue(maxsize=max(1, queue_size))
+        self.next_stage = None
+        self.on_done = None
+        self.threads = []
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"{self.name}-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def put(self, job):
+        # Blocks while this stage is saturated, which pushes backpressure upstream
+        self.queue.put((job.priority, next(self.sequence), job))
+
+    def stop(self):
+        # Sentinels sort after every job, so whatever is queued still gets processed
+        for _ in self.threads:
+            self.queue.put((STOP, next(self.sequence), None))
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _run(self):
+        while True:
+            _, _, job = self.queue.get()
+            if job is None:
+                return
+
+            if job.admission:
+                job.admission.release()
+                job.admission = None
+
+            started = time.perf_counter()
+            try:
+                proceed = self.handler(job)
+            except Exception as e:
+                pub.sendMessage('log_event', message=f"Stage {self.name} failed for {job.pdf_path}: {e}", level=ERROR)
+                job.error = str(e)
+                proceed = False
+            job.timings[self.name] = time.perf_counter() - started
+            metrics.observe("pipeline_stage_seconds", job.timings[self.name], stage=self.name)
+
+            if not proceed:
+                job.failed_stage = self.name
+
+            try:
+                if proceed and self.next_stage and not job.parts:
+                    self.next_stage.put(job)
+                elif self.on_done:
+                    self.on_done(job)
+            except Exception as e:
+                # A dead worker would leave this stage's queue undrained and stop() waiting forever
+                pub.sendMessage('log_event', message=f"Stage {self.name} could not hand off {job.pdf_path}: {e}", level=ERROR)
+
+
+class Pipeline:
+    """Runs the CoreApplication stages concurrently, one worker pool per stage"""
+
+    def __init__(self, app, on_complete=None, claims=None):
+        settings = Config.settings
+        self.app = app
+        self.on_complete = on_complete
+        self.claims = claims
+        # A dry run must not leave journal entries that a real run would later resume
+        self.journal = None if app.dry_run else get_job_journal()
+        self.lock = threading.Lock()
+        self.in_flight = set()
+        self.stopping = False
+        self.backlog = None
+        self.backlog_thread = None
+        # Backlog jobs may fill only half of the first queue, keeping room for live arrivals
+        self.backlog_slots = threading.BoundedSemaphore(max(1, settings.pipeline_queue_size // 2))
+
+        # Files are submitted once they are complete; readiness is decided by the watcher
+        self.stages = []
+        if settings.split_enabled:
+            self.stages.append(Stage("split", self._split, settings.split_workers, settings.pipeline_queue_size))
+        if settings.roi_ocr_enabled:
+            self.stages.append(Stage("header", self._analyze_header, settings.analyze_workers, settings.pipeline_queue_size))
+        self.stages += [
+            Stage("convert", self._convert, settings.convert_workers, settings.pipeline_queue_size),
+            Stage("ocr", self._ocr, settings.ocr_stage_workers, settings.pipeline_queue_size),
+            Stage("analyze", self._analyze, settings.analyze_workers, settings.pipeline_queue_size),
+            Stage("route", self._route, settings.route_workers, settings.pipeline_queue_size),
+        ]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next_stage = next_stage
+        for stage in self.stages:
+            stage.on_done = self._job_done
+            metrics.gauge("queue_depth", stage.queue.qsize, stage=stage.name)
+        metrics.gauge("jobs_in_flight", lambda: len(self.in_flight))
+
+    def start(self):
+        for stage in reversed(self.stages):
+            stage.start()
+
+    def submit(self, pdf_path, priority=LIVE):
+        """Queue a file unless it is already in the pipeline; returns whether it was queued.
+
+        Raises when the file cannot be hashed or journaled, leaving it free to be submitted again.
+        """
+        if not self.claims:
+            return self._enqueue(pdf_path, priority)
+
+        # Shared inbox: only the instance whose rename succeeds processes the file
+        claimed_path = self.claims.claim(pdf_path)
+        if not claimed_path:
+            return False
+        try:
+            return self._enqueue(claimed_path, priority)
+        except Exception:
+            if claimed_path != os.path.normpath(pdf_path):
+                # Back into the inbox, where a retry of the same path finds it
+                try:
+                    self.claims.release(claimed_path, os.path.basename(pdf_path))
+                except OSError as e:
+                    pub.sendMessage('log_event', message=(
+                        f"Failed to return {claimed_path} to the inbox: {e}; it stays claimed until the next start"
+                    ), level=ERROR)
+            raise
+
+    def _enqueue(self, pdf_path, priority, stage=None):
+        """Queue a file; raises when it cannot be hashed or journaled, so the caller can try again"""
+        with self.lock:
+            if pdf_path in self.in_flight:
+                return False
+            self.in_flight.add(pdf_path)
+
+        job = Job(pdf_path, priority)
+        if self.journal:
+            try:
+                self._open_journal_entry(job)
+            except Exception:
+                with self.lock:
+                    self.in_flight.discard(pdf_path)
+                raise
+
+        if stage is None:
+            stage = self.stages[0]
+            if priority == BACKLOG:
+                self.backlog_slots.acquire()
+                job.admission = self.backlog_slots
+        stage.put(job)
+        return True
+
+    def _open_journal_entry(self, job):
+        # Unlike the cache, the journal cannot do without the hash
+        job.file_hash = hash_file(job.pdf_path)
+        entry = self.journal.begin(job.pdf_path, job.file_hash)
+        if entry["state"] != job_states.RECEIVED:
+            pub.sendMessage('log_event', message=f"Resuming {job.pdf_path} after stage {entry['state']}")
+        job.restore(entry)
+        if job.output_path:
+            # Not on disk until the move is finished; no other letter may take the name meanwhile
+            self.app.reserve_output_path(job.output_path)
+
+    def resume_interrupted(self):
+        """Requeue jobs that were in flight when the previous run stopped"""
+        if not self.journal:
+            return
+
+        for entry in self.journal.unfinished():
+            if os.path.exists(entry["pdf_path"]):
+                # Other instances on this machine may share the journal; their claims are not ours to resume
+                if self.claims and not self.claims.owns(entry["pdf_path"]):
+                    continue
+                try:
+                    self.submit(entry["pdf_path"])
+                except Exception as e:
+                    pub.sendMessage('log_event', message=(
+                        f"Failed to resume {entry['pdf_path']}: {e}; it is tried again on the next start"
+                    ), level=ERROR)
+            elif entry["state"] == job_states.ROUTING and entry["output_path"] and os.path.exists(entry["output_path"]):
+                # The final move completed just before the previous run stopped
+                self.journal.complete(entry["id"], entry["output_path"])
+            else:
+                # Also closes entries of stopped instances whose claims went back to the inbox under a new path
+                self.journal.fail(entry["id"], "source file disappeared")
+
+    def submit_backlog(self, pdf_paths):
+        """Feed files that were waiting before startup from a background thread"""
+        self.backlog = BacklogProgress(len(pdf_paths), Config.settings.backlog_progress_interval)
+        self.backlog_thread = threading.Thread(target=self._feed_backlog, args=(pdf_paths,), name="backlog", daemon=True)
+        self.backlog_thread.start()
+
+    def _feed_backlog(self, pdf_paths):
+        for pdf_path in pdf_paths:
+            if self.stopping:
+                return
+            # Skip files a live event already picked up, or already routed away
+            try:
+                queued = os.path.exists(pdf_path) and self.submit(pdf_path, BACKLOG)
+            except Exception as e:
+                pub.sendMessage('log_event', message=(
+                    f"Failed to queue {pdf_path}: {e}; it is tried again on the next start"
+                ), level=ERROR)
+                queued = False
+            if not queued:
+                self.backlog.record_done()
+
+    def _job_done(self, job):
+        with self.lock:
+            self.in_flight.discard(job.pdf_path)
+        result = "split" if job.parts else f"failed_{job.failed_stage}" if job.failed_stage else "done"
+        metrics.inc("documents_total", result=result)
+        # End to end, including the time spent waiting in the stage queues
+        metrics.observe("document_seconds", time.monotonic() - job.submitted_at)
+        if self.journal and job.journal_id and job.failed_stage:
+            self.journal.fail(job.journal_id, f"{job.failed_stage}: {job.error or 'see log'}")
+        if job.priority == BACKLOG and self.backlog and not job.parts:
+            self.backlog.record_done()
+        if self.on_complete:
+            self.on_complete(job)
+
+    def stop(self):
+        self.stopping = True
+        if self.backlog_thread:
+            self.backlog_thread.join()
+        # Stopping front to back lets every job already accepted drain through the later stages
+        for stage in self.stages:
+            stage.stop()
+        # OCR pages are spread over a shared process pool; the stage threads only wait on it
+        shutdown_ocr_executor()
+
+    def _analyze_header(self, job):
+        if not job.letter_details:
+            job.letter_details = self.app.analyze_header(job.pdf_path)
+            if job.letter_details and self.journal:
+                self.journal.record_analysis(job.journal_id, job.letter_details.model_dump_json())
+        return True
+
+    def _split(self, job):
+        if job.ocr_text or job.letter_details:
+            return True
+        # With claims the letters stay in this instance's claim directory, so they are recovered like any claim
+        parts_dir = os.path.dirname(job.pdf_path) if self.claims else self.app.split_parts_dir(job.pdf_path)
+        parts = self.app.split_document(job.pdf_path, parts_dir)
+        if not parts:
+            return True
+
+        # The letters are on disk before the batch leaves the inbox, so a crash in between loses nothing
+        job.output_path = self.app.archive_split_original(job.pdf_path)
+        if self.journal:
+            self.journal.complete(job.journal_id, job.output_path or "")
+        job.parts = parts
+        counted = job.priority == BACKLOG and self.backlog
+        if counted:
+            # Progress counts letters: the batch itself is replaced by its parts
+            self.backlog.add(len(parts) - 1)
+        for part in parts:
+            # Straight to the next stage: a split worker waiting on its own full queue would never return
+            try:
+                queued = self._enqueue(part, job.priority, self.stages[1])
+            except Exception as e:
+                pub.sendMessage('log_event', message=f"Failed to queue letter {part}: {e}; it is left in place", level=ERROR)
+                queued = False
+            if not queued and counted:
+                self.backlog.record_done()
+        return True
+
+    # Jobs resolved from the header, or resumed from the journal, skip the stages already done
+
+    def _convert(self, job):
+        if job.ocr_text or job.letter_details:
+            return True
+        # Only opens the document; pages are rendered lazily while the OCR stage consumes them
+        if job.file_hash is None:
+            job.file_hash = self.app.hash_document(job.pdf_path)
+        job.pages = self.app.convert_pdf_to_images(job.pdf_path, job.file_hash)
+        return bool(job.pages)
+
+    def _ocr(self, job):
+        if job.ocr_text or job.letter_details:
+            return True
+        job.ocr_text = self.app.perform_ocr(job.pages, job.file_hash)
+        job.pages = None
+        if job.ocr_text and self.journal:
+            self.journal.record_ocr(job.journal_id, job.ocr_text)
+        return bool(job.ocr_text)
+
+    def _analyze(self, job):
+        if job.letter_details:
+            return True
+        job.letter_details = self.app.analyze_text(job.ocr_text)
+        if job.letter_details and self.journal:
+            self.journal.record_analysis(job.journal_id, job.letter_details.model_dump_json())
+        return bool(job.letter_details)
+
+    def _route(self, job):
+        if not job.output_path:
+            job.worker_name, job.csv_filename, job.matched_receiver = self.app.find_worker(job.letter_details)
+            if not job.worker_name:
+                return False
+
+            job.output_path = self.app.resolve_output_path(job.pdf_path, job.letter_details, job.worker_name, job.matched_receiver)
+            if not job.output_path:
+                return False
+            # Recording the destination first makes the move safe to finish after a crash
+            if self.journal:
+                self.journal.record_route(job.journal_id, job.worker_name, job.csv_filename,
+                                          job.matched_receiver, job.output_path)
+
+        if not self.app.move_pdf(job.pdf_path, job.output_path):
+            return False
+        if self.journal:
+            self.journal.complete(job.journal_id, job.output_path)
+        return True
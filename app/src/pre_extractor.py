@@ -0,0 +1,244 @@
+"""Rule-based extraction of the routing fields, tried before the LLM.
+
+Letters usually print the recipient exactly as the caseworker CSVs list them,
+carry one obvious date and name the sender organisation in the letterhead.
+The rules below find those in the first lines of the text and score each
+field from 0 to 1, so the LLM only has to be asked about what is left.
+"""
+import re
+import threading
+from datetime import date
+from rapidfuzz import fuzz, utils
+
+from app.src.metrics import metrics
+from app.src.models import LetterDetails
+
+# Letterhead, address window, date and subject sit within the first lines of page 1
+HEADER_LINES = 30
+LETTERHEAD_LINES = 6
+# Longer lines or lines with digits are street addresses, references or body text, never a bare name
+MAX_NAME_WORDS = 6
+
+LABEL = re.compile(
+    r"^\s*(to|an|recipient|empfänger|from|von|sender|absender|date|datum|subject|betreff|re)\s*:\s*",
+    re.IGNORECASE,
+)
+LABEL_FIELDS = {
+    "to": "receiver", "an": "receiver", "recipient": "receiver", "empfänger": "receiver",
+    "from": "sender", "von": "sender", "sender": "sender", "absender": "sender",
+    "date": "date_of_writing", "datum": "date_of_writing",
+    "subject": "type_of_letter", "betreff": "type_of_letter", "re": "type_of_letter",
+}
+# The greeting ends the header; dates below it are due dates and references, not the date of writing
+GREETING = re.compile(r"^(dear|sehr geehrte[rs]?|guten tag|hallo|liebe[rs]?|to whom it may concern)\b", re.IGNORECASE)
+SALUTATION = re.compile(r"^(herrn?|frau|mr|mrs|ms|miss|dr|prof|z\.?\s*hd\.?|attn\.?|c/o)\.?\s+", re.IGNORECASE)
+ORGANISATION = re.compile(
+    r"\b(gmbh|ag|kg|ohg|e\.\s?v|ltd|limited|inc|llc|plc|corp|se|bank|sparkasse|versicherung|insurance|"
+    r"office|amt|finanzamt|krankenkasse|health|telecom|energy|stadtwerke|pensions?|housing|fund|"
+    r"gesellschaft|verwaltung|ministerium|council|agency|authority)\b",
+    re.IGNORECASE,
+)
+
+MONTHS = {
+    "january": 1, "jan": 1, "januar": 1, "jänner": 1,
+    "february": 2, "feb": 2, "februar": 2,
+    "march": 3, "mar": 3, "märz": 3, "maerz": 3, "mrz": 3,
+    "april": 4, "apr": 4,
+    "may": 5, "mai": 5,
+    "june": 6, "jun": 6, "juni": 6,
+    "july": 7, "jul": 7, "juli": 7,
+    "august": 8, "aug": 8,
+    "september": 9, "sep": 9, "sept": 9,
+    "october": 10, "oct": 10, "oktober": 10, "okt": 10,
+    "november": 11, "nov": 11,
+    "december": 12, "dec": 12, "dezember": 12, "dez": 12,
+}
+MONTH_NAMES = "|".join(sorted(MONTHS, key=len, reverse=True))
+DATE_PATTERNS = (
+    (re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b"), ("year", "month", "day")),
+    (re.compile(r"\b(\d{1,2})[./](\d{1,2})[./](\d{4})\b"), ("day", "month", "year")),
+    (re.compile(rf"\b(\d{{1,2}})\.?\s+({MONTH_NAMES})\.?\s+(\d{{4}})\b", re.IGNORECASE), ("day", "month", "year")),
+    (re.compile(rf"\b({MONTH_NAMES})\.?\s+(\d{{1,2}}),?\s+(\d{{4}})\b", re.IGNORECASE), ("month", "day", "year")),
+)
+
+
+def find_dates(line):
+    """Valid calendar dates in the line, as (text as printed, date)"""
+    found = []
+    for pattern, order in DATE_PATTERNS:
+        for match in pattern.finditer(line):
+            parts = dict(zip(order, match.groups()))
+            month = parts["month"]
+            month = MONTHS[month.lower()] if not month.isdigit() else int(month)
+            try:
+                found.append((match.group(0), date(int(parts["year"]), month, int(parts["day"]))))
+            except ValueError:
+                continue
+    return found
+
+
+def strip_salutation(text):
+    previous = None
+    while previous != text:
+        previous, text = text, SALUTATION.sub("", text)
+    return text.strip(" ,;")
+
+
+class PreExtraction:
+    """Field values found by the rules, each with a confidence between 0 and 1"""
+
+    def __init__(self):
+        self.values = {field: "" for field in LetterDetails.model_fields}
+        self.confidence = {field: 0.0 for field in LetterDetails.model_fields}
+
+    def set(self, field, value, confidence):
+        if confidence > self.confidence[field]:
+            self.values[field] = value
+            self.confidence[field] = confidence
+
+    def uncertain_fields(self, min_confidence, fields):
+        return [field for field in fields if self.confidence[field] < min_confidence]
+
+    def letter_details(self, **values):
+        return LetterDetails(**{**self.values, **values})
+
+    def merge(self, letter_details, min_confidence):
+        """Keep the LLM's answer only for the fields the rules were not sure about"""
+        confident = {field: value for field, value in self.values.items()
+                     if self.confidence[field] >= min_confidence}
+        return letter_details.model_copy(update=confident)
+
+    def describe(self):
+        return ", ".join(f"{field} {confidence:.2f}" for field, confidence in self.confidence.items())
+
+
+class PreExtractor:
+    """Finds recipient, date and sender organisation without the LLM"""
+
+    def __init__(self, recipient_index, fuzzy_threshold, subject_confidence):
+        self.index = recipient_index
+        self.fuzzy_threshold = fuzzy_threshold
+        self.subject_confidence = subject_confidence
+
+    def extract(self, text):
+        self.index.refresh()
+        lines = [line.strip() for line in text.splitlines() if line.strip()][:HEADER_LINES]
+        labelled = []
+        for line in lines:
+            match = LABEL.match(line)
+            field = LABEL_FIELDS[match.group(1).lower()] if match else None
+            labelled.append((field, line[match.end():].strip() if match else line))
+
+        extraction = PreExtraction()
+        self._find_receiver(labelled, extraction)
+        self._find_date(labelled, extraction)
+        self._find_sender(labelled, extraction)
+
+        subject = next((value for field, value in labelled if field == "type_of_letter" and value), None)
+        if subject:
+            # A subject line is not necessarily a summary in the configured language; how far to trust it is a setting
+            extraction.set("type_of_letter", " ".join(subject.split()[:5]), self.subject_confidence)
+        if extraction.confidence["receiver"] >= 0.9:
+            # Routing goes by the CSV that lists the receiver; the responsible person only matters without one
+            extraction.set("responsible_person", "", 1.0)
+        return extraction
+
+    def _find_receiver(self, labelled, extraction):
+        matches = []
+        for field, value in labelled:
+            if field not in (None, "receiver"):
+                continue
+            candidate = strip_salutation(value)
+            if not candidate:
+                continue
+
+            match = self.index.exact_match(candidate)
+            if match:
+                score = 1.0
+            else:
+                if len(candidate.split()) > MAX_NAME_WORDS or any(c.isdigit() for c in candidate):
+                    continue
+                match = self.index.best_match(candidate, threshold=self.fuzzy_threshold)
+                if not match:
+                    continue
+                score = fuzz.ratio(utils.default_process(candidate), utils.default_process(match[1])) / 100
+            # An explicit "To:" is certain; a bare name could also be a contact person further down
+            matches.append((match[1], score * (1.0 if field == "receiver" else 0.95)))
+
+        if not matches:
+            return
+        receiver, confidence = max(matches, key=lambda item: item[1])
+        if len({name for name, _ in matches}) > 1:
+            # Several known recipients in the header: the letter may be about one and addressed to another
+            confidence *= 0.5
+        extraction.set("receiver", receiver, confidence)
+
+    def _find_date(self, labelled, extraction):
+        dates = []
+        for field, value in labelled:
+            if field is None and GREETING.match(value):
+                break
+            for text, parsed in find_dates(value):
+                if field == "date_of_writing":
+                    extraction.set("date_of_writing", text, 0.95)
+                    return
+                dates.append((text, parsed))
+
+        if dates:
+            # One distinct date above the greeting is the date of writing; with several it is a guess
+            distinct = {parsed for _, parsed in dates}
+            extraction.set("date_of_writing", dates[0][0], 0.9 if len(distinct) == 1 else 0.5)
+
+    def _find_sender(self, labelled, extraction):
+        for field, value in labelled:
+            if field == "sender" and value:
+                extraction.set("sender", value, 0.95)
+                if ORGANISATION.search(value):
+                    extraction.set("organisation", value, 0.95)
+                else:
+                    # Could be a private person, for whom the organisation stays empty
+                    extraction.set("organisation", value, 0.5)
+                return
+
+        receiver = utils.default_process(extraction.values["receiver"])
+        for field, value in labelled[:LETTERHEAD_LINES]:
+            if field is None and ORGANISATION.search(value) and not find_dates(value) \
+                    and len(value.split()) <= MAX_NAME_WORDS and utils.default_process(value) != receiver:
+                # A legal form or institution word in the letterhead is as reliable as an unlabelled date
+                extraction.set("organisation", value, 0.9)
+                extraction.set("sender", value, 0.9)
+                return
+
+
+class PreExtractionStats:
+    """How often the rules made the LLM call unnecessary or reduced it to the summary"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.skipped = 0
+        self.summary_only = 0
+        self.full = 0
+
+    def record(self, outcome):
+        with self.lock:
+            if outcome == "skipped":
+                self.skipped += 1
+            elif outcome == "summary_only":
+                self.summary_only += 1
+            else:
+                self.full += 1
+        metrics.inc("pre_extraction_total", outcome=outcome)
+
+    def snapshot(self):
+        with self.lock:
+            total = self.skipped + self.summary_only + self.full
+            return {
+                "skipped": self.skipped,
+                "summary_only": self.summary_only,
+                "full": self.full,
+                "llm_skip_rate": self.skipped / total if total else 0.0,
+                "full_analysis_skip_rate": (self.skipped + self.summary_only) / total if total else 0.0,
+            }
+
+
+pre_extraction_stats = PreExtractionStats()
@@ -0,0 +1,150 @@
+"""Page clean-up between rasterization and OCR.
+
+Every step works on a NumPy array of the grayscale page, so it runs at C
+speed inside the OCR worker processes. Pages that turn out blank are
+dropped before they reach Tesseract.
+"""
+import time
+
+import numpy as np
+from PIL import Image
+
+from config import Config
+
+# Scanner separator sheets and empty backs still carry some dust; ink is judged per block, not per pixel
+BLANK_BLOCK = 8
+INK_LEVEL = 128
+
+
+def preprocessing_signature():
+    """Settings that change the image Tesseract sees, for use in cache keys"""
+    settings = Config.settings
+    if not settings.preprocess_enabled:
+        return "off"
+    return ":".join(str(value) for value in (
+        settings.raster_dpi, settings.preprocess_target_dpi, settings.preprocess_remove_borders,
+        settings.preprocess_skip_blank, settings.preprocess_blank_ink_ratio, settings.preprocess_deskew,
+        settings.preprocess_max_skew, settings.preprocess_binarize, settings.preprocess_binarize_threshold,
+    ))
+
+
+def preprocess_page(image):
+    """Return (cleaned image, or None for a blank page, {step: seconds})"""
+    settings = Config.settings
+    timings = {}
+
+    def step(name, function, *args):
+        started = time.perf_counter()
+        result = function(*args)
+        timings[name] = time.perf_counter() - started
+        return result
+
+    pixels = step("grayscale", to_grayscale, image)
+    dpi = settings.raster_dpi
+    if settings.preprocess_target_dpi and dpi > settings.preprocess_target_dpi:
+        pixels = step("downscale", downscale, pixels, settings.preprocess_target_dpi / dpi)
+        dpi = settings.preprocess_target_dpi
+    if settings.preprocess_remove_borders:
+        pixels = step("borders", remove_borders, pixels)
+    if settings.preprocess_skip_blank and step("blank", is_blank, pixels, settings.preprocess_blank_ink_ratio):
+        return None, timings
+    if settings.preprocess_deskew:
+        pixels = step("deskew", deskew, pixels, settings.preprocess_max_skew)
+    if settings.preprocess_binarize:
+        pixels = step("binarize", binarize, pixels, max(3, dpi // 8), settings.preprocess_binarize_threshold)
+
+    return Image.fromarray(pixels), timings
+
+
+def to_grayscale(image):
+    if image.mode != "L":
+        image = image.convert("L")
+    return np.asarray(image)
+
+
+def downscale(pixels, factor):
+    height, width = pixels.shape
+    size = (max(1, int(width * factor)), max(1, int(height * factor)))
+    # Box filtering averages the dropped pixels instead of aliasing thin strokes away
+    return np.asarray(Image.fromarray(pixels).resize(size, Image.BOX))
+
+
+def remove_borders(pixels, dark_ratio=0.5):
+    """Crop the dark bands a scanner lid or a skewed feed leaves along the edges"""
+    dark = pixels < INK_LEVEL
+    rows = dark.mean(axis=1) > dark_ratio
+    columns = dark.mean(axis=0) > dark_ratio
+
+    def edge_run(flags):
+        # Length of the run of True values at the start
+        return int(np.argmin(flags)) if not flags.all() else len(flags)
+
+    top, bottom = edge_run(rows), len(rows) - edge_run(rows[::-1])
+    left, right = edge_run(columns), len(columns) - edge_run(columns[::-1])
+    if top >= bottom or left >= right:
+        return pixels
+    return pixels[top:bottom, left:right]
+
+
+def block_ink(pixels, block=BLANK_BLOCK):
+    """Boolean map of blocks dark enough on average to contain ink; isolated specks average away"""
+    height, width = pixels.shape
+    height, width = height - height % block, width - width % block
+    if not height or not width:
+        return np.zeros((0, 0), dtype=bool)
+    blocks = pixels[:height, :width].reshape(height // block, block, width // block, block).mean(axis=(1, 3))
+    return blocks < 200
+
+
+def is_blank(pixels, ink_ratio):
+    ink = block_ink(pixels)
+    return ink.size == 0 or ink.mean() < ink_ratio
+
+
+def estimate_skew(pixels, max_angle, step=0.25):
+    """Angle in degrees whose horizontal projection of the ink has the sharpest line structure"""
+    ys, xs = np.nonzero(pixels < INK_LEVEL)
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > 50000:
+        # A fixed-stride sample keeps the cost flat for dense pages while staying deterministic
+        stride = len(ys) // 50000 + 1
+        ys, xs = ys[::stride], xs[::stride]
+
+    angles = np.arange(-max_angle, max_angle + step / 2, step)
+    # Shear every ink pixel for every candidate angle at once: rows of (angles x pixels)
+    shifted = ys[None, :] - xs[None, :] * np.tan(np.radians(angles))[:, None]
+    shifted = np.round(shifted - shifted.min()).astype(np.int64)
+    bins = int(shifted.max()) + 1
+    offsets = (np.arange(len(angles)) * bins)[:, None]
+    histograms = np.bincount((shifted + offsets).ravel(), minlength=len(angles) * bins).reshape(len(angles), bins)
+    scores = (histograms.astype(np.float64) ** 2).sum(axis=1)
+    return float(angles[int(np.argmax(scores))])
+
+
+def deskew(pixels, max_angle):
+    angle = estimate_skew(pixels, max_angle)
+    if abs(angle) < 0.1:
+        return pixels
+    # Lines sloping down to the right give a positive angle; PIL rotates counter-clockwise, which levels them
+    rotated = Image.fromarray(pixels).rotate(angle, resample=Image.BILINEAR, fillcolor=255)
+    return np.asarray(rotated)
+
+
+def binarize(pixels, window, threshold):
+    """Bradley adaptive thresholding: ink is whatever is darker than its neighbourhood by threshold"""
+    height, width = pixels.shape
+    integral = np.zeros((height + 1, width + 1), dtype=np.float64)
+    integral[1:, 1:] = pixels.cumsum(axis=0, dtype=np.float64).cumsum(axis=1)
+
+    half = window // 2
+    top = np.clip(np.arange(height) - half, 0, height)
+    bottom = np.clip(np.arange(height) + half + 1, 0, height)
+    left = np.clip(np.arange(width) - half, 0, width)
+    right = np.clip(np.arange(width) + half + 1, 0, width)
+
+    sums = (integral[bottom][:, right] - integral[top][:, right]
+            - integral[bottom][:, left] + integral[top][:, left])
+    areas = (bottom - top)[:, None] * (right - left)[None, :]
+    ink = pixels * areas < sums * (1.0 - threshold)
+    return np.where(ink, 0, 255).astype(np.uint8)
@@ -0,0 +1,170 @@
+import heapq
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pubsub import pub
+
+from app.src.log_events import ERROR, WARNING
+
+
+class PendingFile:
+    def __init__(self, now):
+        self.first_seen = now
+        self.due = None
+        self.closed = False
+        self.generation = 0
+        self.last_stat = None
+        self.submit_failures = 0
+
+
+class ReadinessTracker:
+    """Decides when a new file is complete, driven by filesystem events.
+
+    A close-after-write or a move into the folder marks a file complete after a
+    short debounce. Without those events (non-inotify platforms, network shares)
+    it falls back to polling until size and mtime stop changing.
+    """
+
+    def __init__(self, is_file_locked, on_ready, debounce, poll_interval, timeout, workers):
+        self.is_file_locked = is_file_locked
+        self.on_ready = on_ready
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.workers = max(1, workers)
+        self.pending = {}
+        self.schedule = []
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+        self.executor = None
+
+    def start(self):
+        self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="readiness")
+        self.thread = threading.Thread(target=self._run, name="readiness-scheduler", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread:
+            self.thread.join()
+        if self.executor:
+            self.executor.shutdown()
+
+    def track(self, file_path, closed=False):
+        """Record activity on a file; the readiness check is pushed back by the debounce"""
+        with self.condition:
+            now = time.monotonic()
+            state = self.pending.get(file_path)
+            if state is None:
+                state = self.pending[file_path] = PendingFile(now)
+            # A write after a close means the file was reopened, so it is no longer complete
+            state.closed = closed
+            state.generation += 1
+            self._schedule(file_path, state, now + self.debounce)
+
+    def forget(self, file_path):
+        with self.condition:
+            self.pending.pop(file_path, None)
+
+    def _schedule(self, file_path, state, due):
+        state.due = due
+        heapq.heappush(self.schedule, (due, file_path))
+        self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.running:
+                    return
+
+                now = time.monotonic()
+                ready = []
+                while self.schedule and self.schedule[0][0] <= now:
+                    due, file_path = heapq.heappop(self.schedule)
+                    state = self.pending.get(file_path)
+                    # Entries superseded by a later event or already forgotten are skipped
+                    if state is not None and state.due == due:
+                        state.due = None
+                        ready.append((file_path, state.generation))
+
+                if not ready:
+                    self.condition.wait(self.schedule[0][0] - now if self.schedule else None)
+                    continue
+
+            for file_path, generation in ready:
+                self.executor.submit(self._check, file_path, generation)
+
+    def _check(self, file_path, generation):
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            pub.sendMessage('log_event', message=f"File disappeared: {file_path}")
+            self.forget(file_path)
+            return
+        except OSError as e:
+            pub.sendMessage('log_event', message=f"Error checking {file_path}: {e}", level=WARNING)
+            stat = None
+
+        with self.condition:
+            state = self.pending.get(file_path)
+            if state is None or state.generation != generation:
+                return
+
+            current = (stat.st_size, stat.st_mtime_ns) if stat else None
+            stable = current is not None and (state.closed or current == state.last_stat)
+            state.last_stat = current
+
+        if stable and not self.is_file_locked(file_path) and self._can_read(file_path):
+            with self.condition:
+                state = self.pending.get(file_path)
+                if state is None or state.generation != generation:
+                    return
+                del self.pending[file_path]
+            pub.sendMessage('log_event', message=f"File ready: {file_path}")
+            try:
+                self.on_ready(file_path)
+            except Exception as e:
+                self._retry_submit(file_path, state, e)
+            return
+
+        with self.condition:
+            state = self.pending.get(file_path)
+            if state is None or state.generation != generation or state.due is not None:
+                return
+            if time.monotonic() - state.first_seen > self.timeout:
+                del self.pending[file_path]
+                pub.sendMessage('log_event', message=f"Failed to process: {file_path}", level=ERROR)
+                return
+            self._schedule(file_path, state, time.monotonic() + self.poll_interval)
+
+    def _retry_submit(self, file_path, state, error):
+        """Keep a complete file whose hand-off failed (claim, journal or hashing errors) and try again later"""
+        state.submit_failures += 1
+        # Doubles per failure, capped at the readiness timeout so a lasting problem is retried at a steady pace
+        delay = min(self.poll_interval * 2 ** (state.submit_failures - 1), max(self.poll_interval, self.timeout))
+        pub.sendMessage('log_event', message=(
+            f"Failed to queue {file_path}: {error}; retrying in {delay:.1f}s"
+        ), level=ERROR)
+        with self.condition:
+            if file_path in self.pending:
+                # A newer event already tracks the file again
+                return
+            # The file was complete, so the retry does not wait for it to become stable again
+            state.closed = True
+            state.generation += 1
+            self.pending[file_path] = state
+            self._schedule(file_path, state, time.monotonic() + delay)
+
+    def _can_read(self, file_path):
+        try:
+            with open(file_path, 'rb') as f:
+                f.read(1)
+            return True
+        except IOError as e:
+            pub.sendMessage('log_event', message=f"Final check failed: {str(e)}")
+            return False
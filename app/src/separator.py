@@ -0,0 +1,131 @@
+"""Separation of scanner batches into single letters.
+
+A high-speed scanner turns a whole tray of mail into one PDF. Each page is
+classified as a separator sheet (blank page or separator barcode), the first
+page of a new letter, or a continuation page. The page ranges found are then
+copied into their own PDFs without re-encoding the scanned images.
+"""
+import os
+import re
+from pdf2image import convert_from_path, pdfinfo_from_path
+from pypdf import PdfReader, PdfWriter
+from pubsub import pub
+
+from config import Config
+from app.src.log_events import WARNING
+from app.src.ocr_backends import get_ocr_backend
+from app.src.preprocess import is_blank, remove_borders, to_grayscale
+
+SEPARATOR = "separator"
+START = "start"
+CONTINUATION = "continuation"
+
+PAGE_NUMBER = re.compile(r"\b(?:page|seite)\s+(\d+)\s*(?:of|von|/)\s*(\d+)\b", re.IGNORECASE)
+
+
+def load_barcode_reader():
+    """pyzbar's decode function, or None when pyzbar or the zbar library is not installed"""
+    try:
+        from pyzbar import pyzbar
+    except ImportError as e:
+        pub.sendMessage('log_event', message=f"pyzbar unavailable ({e}), separator barcodes are not detected", level=WARNING)
+        return None
+    return pyzbar.decode
+
+
+class DocumentSeparator:
+    """Finds where one letter ends and the next begins in a scanner batch"""
+
+    def __init__(self, pre_extractor):
+        settings = Config.settings
+        self.pre_extractor = pre_extractor
+        self.barcode_pattern = re.compile(settings.split_barcode_pattern, re.IGNORECASE) if settings.split_barcode_pattern else None
+        self.decode_barcodes = load_barcode_reader() if self.barcode_pattern else None
+
+    def find_documents(self, pdf_path, text_layer):
+        """Return the letters as (first page, last page) ranges, separator sheets left out"""
+        page_count = pdfinfo_from_path(pdf_path)["Pages"]
+        documents = []
+        current = None
+        for page_number, text, image in self._pages(pdf_path, page_count, text_layer):
+            kind = self.classify_page(text, image)
+            if kind == SEPARATOR:
+                current = None
+            elif kind == START or current is None:
+                current = [page_number, page_number]
+                documents.append(current)
+            else:
+                current[1] = page_number
+        return [tuple(document) for document in documents]
+
+    def classify_page(self, text, image):
+        settings = Config.settings
+        if image is not None:
+            if self.decode_barcodes and self._has_separator_barcode(image):
+                return SEPARATOR
+            if settings.split_blank_pages and text is None \
+                    and is_blank(remove_borders(to_grayscale(image)), settings.preprocess_blank_ink_ratio):
+                return SEPARATOR
+
+        if not settings.split_detect_starts:
+            return CONTINUATION
+        if text is None:
+            text = self._header_text(image)
+        return START if self.is_first_page(text) else CONTINUATION
+
+    def is_first_page(self, text):
+        # A printed page number settles it; otherwise a known recipient together with a date marks a letter head
+        match = PAGE_NUMBER.search(text)
+        if match:
+            return match.group(1) == "1"
+        extraction = self.pre_extractor.extract(text)
+        return (extraction.confidence["receiver"] >= Config.settings.pre_extract_min_confidence
+                and extraction.values["date_of_writing"] != "")
+
+    def write_parts(self, pdf_path, documents, directory):
+        """Copy each page range into its own PDF in directory and return the paths"""
+        reader = PdfReader(pdf_path)
+        stem = os.path.splitext(os.path.basename(pdf_path))[0]
+        paths = []
+        for index, (first_page, last_page) in enumerate(documents, start=1):
+            writer = PdfWriter()
+            for page in reader.pages[first_page - 1:last_page]:
+                # Page objects are copied as they are, so the scanned images keep their original encoding
+                writer.add_page(page)
+
+            path = os.path.join(directory, f"{stem}_part{index:02d}_p{first_page}-{last_page}.pdf")
+            temp_path = path + ".tmp"
+            with open(temp_path, 'wb') as f:
+                writer.write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, path)
+            paths.append(path)
+        return paths
+
+    def _pages(self, pdf_path, page_count, text_layer):
+        """Yield (page number, text layer or None, low resolution image or None) for every page"""
+        settings = Config.settings
+        window = max(1, settings.raster_window)
+        for first_page in range(1, page_count + 1, window):
+            last_page = min(page_count, first_page + window - 1)
+            numbers = range(first_page, last_page + 1)
+            if self.decode_barcodes or any(number not in text_layer for number in numbers):
+                images = convert_from_path(pdf_path, dpi=settings.split_dpi, grayscale=True,
+                                           thread_count=settings.raster_thread_count,
+                                           first_page=first_page, last_page=last_page)
+            else:
+                images = [None] * len(numbers)
+            for number, image in zip(numbers, images):
+                yield number, text_layer.get(number), image
+
+    def _has_separator_barcode(self, image):
+        for symbol in self.decode_barcodes(image):
+            if self.barcode_pattern.search(symbol.data.decode('utf-8', errors='replace')):
+                return True
+        return False
+
+    def _header_text(self, image):
+        width, height = image.size
+        header = image.crop((0, 0, width, int(height * Config.settings.split_header_fraction)))
+        return get_ocr_backend().image_to_string(header)
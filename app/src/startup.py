@@ -0,0 +1,142 @@
+"""Startup profiling and background warm-up.
+
+Run with --profile-startup (or PROFILE_STARTUP=1) to see where the time goes
+between launching and being ready: the time of each startup phase and the
+modules that took longest to import. Only the standard library is imported
+here, so the profiler is in place before config or any dependency loads.
+"""
+import importlib
+import os
+import sys
+import threading
+import time
+
+# Loaded after the window or the watcher is up, before the first letter needs them
+WARM_UP_MODULES = ("app.src.core", "app.src.pipeline", "langchain_openai", "langchain_core.prompts")
+
+
+class ImportTimer:
+    """Meta path finder that times the execution of every module imported after it is installed"""
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # Module name -> (seconds including its own imports, seconds excluding them)
+        self.modules = {}
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        loader = spec.loader
+        # Built-in and frozen modules are loaded by classes shared by all of them; they are cheap anyway
+        if loader is not None and not isinstance(loader, type) and hasattr(loader, "exec_module"):
+            loader.exec_module = self._timed(name, loader.exec_module)
+        return spec
+
+    def _timed(self, name, exec_module):
+        def timed_exec_module(module):
+            stack = self.local.__dict__.setdefault("stack", [])
+            stack.append(0.0)
+            started = time.perf_counter()
+            try:
+                exec_module(module)
+            finally:
+                elapsed = time.perf_counter() - started
+                nested = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                with self.lock:
+                    self.modules[name] = (elapsed, elapsed - nested)
+        return timed_exec_module
+
+    def by_package(self):
+        """Own import time summed per top-level package"""
+        packages = {}
+        with self.lock:
+            for name, (_, own) in self.modules.items():
+                package = name.split(".")[0]
+                packages[package] = packages.get(package, 0.0) + own
+        return packages
+
+
+class StartupProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.enabled = False
+        self.import_timer = None
+        self.phases = []
+        self.lock = threading.Lock()
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.import_timer = ImportTimer()
+        sys.meta_path.insert(0, self.import_timer)
+
+    def mark(self, phase):
+        """Record that a startup phase finished; free when profiling is off"""
+        if self.enabled:
+            with self.lock:
+                self.phases.append((phase, time.perf_counter() - self.started))
+
+    def report(self, top=15):
+        lines = ["Startup profile:"]
+        previous = 0.0
+        with self.lock:
+            phases = list(self.phases)
+        for phase, at in phases:
+            lines.append(f"  {at:7.3f}s  {phase} (+{at - previous:.3f}s)")
+            previous = at
+
+        packages = sorted(self.import_timer.by_package().items(), key=lambda item: item[1], reverse=True)
+        lines.append(f"Import time by package (top {top}):")
+        lines.extend(f"  {seconds:7.3f}s  {package}" for package, seconds in packages[:top])
+
+        with self.lock:
+            application = sorted(((name, times[0]) for name, times in self.import_timer.modules.items()
+                                  if name.startswith("app.") or name == "config"),
+                                 key=lambda item: item[1], reverse=True)
+        lines.append("Application modules, including what they import:")
+        lines.extend(f"  {seconds:7.3f}s  {name}" for name, seconds in application[:top])
+        return "\n".join(lines)
+
+
+startup_profile = StartupProfile()
+
+
+def enable_from_arguments(argv):
+    """Turn profiling on for --profile-startup or PROFILE_STARTUP=1; returns argv without the flag.
+
+    Read from the environment directly rather than from Settings, which would
+    have to import pydantic before the profiler could time it.
+    """
+    requested = "--profile-startup" in argv or os.environ.get("PROFILE_STARTUP", "").lower() in ("1", "true", "yes")
+    if requested:
+        startup_profile.enable()
+    return [argument for argument in argv if argument != "--profile-startup"]
+
+
+def warm_up_in_background(modules=WARM_UP_MODULES, on_done=None):
+    """Import the modules the first letter will need on a daemon thread"""
+    def warm_up():
+        for name in modules:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                # The stage that needs it reports the problem when it runs
+                continue
+        startup_profile.mark("background warm-up done")
+        if on_done:
+            on_done()
+
+    thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+    thread.start()
+    return thread
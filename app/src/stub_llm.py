@@ -0,0 +1,165 @@
+"""Deterministic local stand-in for the chat-completions API.
+
+Answers structured-output requests (tool calls or json_schema response formats)
+by reading "Key: value" lines from the prompt, so the pipeline can be exercised
+without network access or API costs. Point openai_base_url at it, e.g.
+
+    python -m app.src.stub_llm --port 8089
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIELD_ALIASES = {
+    "sender": ("from", "sender"),
+    "receiver": ("to", "recipient", "receiver"),
+    "organisation": ("organisation", "organization", "company"),
+    "date_of_writing": ("date",),
+    "type_of_letter": ("subject", "re"),
+    "responsible_person": ("responsible",),
+}
+
+
+def extract_fields(text, properties):
+    lines = {}
+    for line in text.splitlines():
+        # Keys can appear mid-line, e.g. "... Text: From: ACME Ltd" where the prompt meets the letter
+        for match in re.finditer(r"\b([A-Za-z]+):[ \t]*", line):
+            value = line[match.end():].strip()
+            if value:
+                lines.setdefault(match.group(1).lower(), value)
+
+    fields = {}
+    for name in properties:
+        aliases = FIELD_ALIASES.get(name, (name.replace("_", " "),))
+        fields[name] = next((lines[alias] for alias in aliases if alias in lines), "")
+    return fields
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "StubLLM/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        options = self.server.options
+
+        if options.latency:
+            time.sleep(options.latency)
+        if options.fail_rate and self.server.random.random() < options.fail_rate:
+            self._send(options.fail_status, {"error": {"message": "Injected failure", "type": "stub_error"}})
+            return
+
+        self.server.count_request()
+        self._send(200, self.completion(body))
+
+    def completion(self, body):
+        prompt = "\n".join(message.get("content") or "" for message in body.get("messages", [])
+                           if isinstance(message.get("content"), str))
+
+        message = {"role": "assistant", "content": None}
+        finish_reason = "stop"
+        tools = body.get("tools") or []
+        response_format = body.get("response_format") or {}
+
+        if tools:
+            function = tools[0]["function"]
+            arguments = json.dumps(extract_fields(prompt, function.get("parameters", {}).get("properties", {})))
+            message["tool_calls"] = [{
+                "id": f"call_{self.server.request_count}",
+                "type": "function",
+                "function": {"name": function["name"], "arguments": arguments},
+            }]
+            finish_reason = "tool_calls"
+            completion_text = arguments
+        elif response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"].get("schema", {})
+            completion_text = json.dumps(extract_fields(prompt, schema.get("properties", {})))
+            message["content"] = completion_text
+        else:
+            completion_text = "ok"
+            message["content"] = completion_text
+
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = max(1, len(completion_text) // 4)
+        return {
+            "id": f"chatcmpl-stub-{self.server.request_count}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, options):
+        super().__init__(address, StubHandler)
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.lock = threading.Lock()
+        self.request_count = 0
+
+    def count_request(self):
+        with self.lock:
+            self.request_count += 1
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+
+def start_stub_server(host="127.0.0.1", port=0, latency=0.0, fail_rate=0.0, fail_status=429, seed=0):
+    """Start the stub on a background thread and return the server; port 0 picks a free port"""
+    options = argparse.Namespace(latency=latency, fail_rate=fail_rate, fail_status=fail_status, seed=seed)
+    server = StubServer((host, port), options)
+    threading.Thread(target=server.serve_forever, name="stub-llm", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local chat-completions stub for LetterEye")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each answer")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    parser.add_argument("--fail-status", type=int, default=429)
+    parser.add_argument("--seed", type=int, default=0)
+    options = parser.parse_args()
+
+    server = StubServer((options.host, options.port), options)
+    print(f"Stub LLM listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,37 @@
 import os
 import sys
+import threading
 import time
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from pubsub import pub
 
-from app.src.core import CoreApplication
+from config import Config
+from app.src.claims import InboxClaims
+from app.src.metrics import MetricsExporter
+from app.src.readiness import ReadinessTracker
+from app.src.startup import startup_profile
 
 class PDFHandler(FileSystemEventHandler):
-    def __init__(self, app):
+    def __init__(self, app, folder_to_watch, on_complete=None):
+        from app.src.pipeline import Pipeline
+
         self.app = app
+        self.folder_to_watch = os.path.normpath(folder_to_watch)
         self._setup_platform_specifics()
+        self.claims = None
+        if Config.settings.claims_enabled:
+            self.claims = InboxClaims(self.folder_to_watch, Config.settings.instance_id,
+                                      Config.settings.claim_dir_name, Config.settings.claim_lease_seconds)
+        self.pipeline = Pipeline(app, on_complete=on_complete, claims=self.claims)
+        self.readiness = ReadinessTracker(
+            self._is_file_locked,
+            self.pipeline.submit,
+            debounce=Config.settings.readiness_debounce,
+            poll_interval=Config.settings.readiness_poll_interval,
+            timeout=Config.settings.readiness_timeout,
+            workers=Config.settings.readiness_workers,
+        )
 
     def _setup_platform_specifics(self):
         """Initialize platform-specific components"""
@@ -80,75 +101,109 @@ class PDFHandler(FileSystemEventHandler):
                 return True
             return False
 
+    def enqueue_backlog(self):
+        """Queue the PDFs that were already waiting in the folder before watching started"""
+        entries = []
+        folders = [self.folder_to_watch]
+        # Letters split from a scanner batch by a run that stopped before processing them
+        split_dir = os.path.join(self.folder_to_watch, Config.settings.split_dir_name)
+        if not self.claims and os.path.isdir(split_dir):
+            folders.append(split_dir)
+        for folder in folders:
+            for entry in os.scandir(folder):
+                if entry.is_file() and entry.name.endswith('.pdf'):
+                    entries.append((entry.path, entry.stat()))
+
+        if Config.settings.backlog_order == "smallest":
+            entries.sort(key=lambda entry: entry[1].st_size)
+        else:
+            entries.sort(key=lambda entry: entry[1].st_mtime)
+
+        backlog = []
+        now = time.time()
+        for path, stat in entries:
+            # Anything touched very recently may still be written, so let the readiness tracker decide
+            if now - stat.st_mtime < Config.settings.readiness_poll_interval:
+                self.readiness.track(path)
+            else:
+                backlog.append(path)
+
+        pub.sendMessage('log_event', message=f"Found {len(entries)} PDFs waiting in {self.folder_to_watch}")
+        if backlog:
+            self.pipeline.submit_backlog(backlog)
+
+    def resume_claimed(self):
+        """Queue files this instance had claimed when it last stopped"""
+        claimed = self.claims.claimed_files()
+        if claimed:
+            pub.sendMessage('log_event', message=f"Resuming {len(claimed)} PDFs claimed by the previous run")
+            for pdf_path in claimed:
+                self.pipeline.submit(pdf_path)
+
+    def _is_pdf(self, event, path):
+        return not event.is_directory and path.endswith('.pdf')
+
     def on_created(self, event):
-        if event.is_directory:
-            return
-        if event.src_path.endswith('.pdf'):
+        if self._is_pdf(event, event.src_path):
             pub.sendMessage('log_event', message=f"New PDF detected: {event.src_path}")
-            if self._wait_for_file(event.src_path):
-                self.app.run(event.src_path)
+            self.readiness.track(event.src_path)
 
-    def _wait_for_file(self, file_path, wait_time=2, max_attempts=30):
-        """Wait until file is stable and unlocked"""
-        stable_checks = 0
-        required_stable_checks = 3
-        attempts = 0
+    def on_modified(self, event):
+        if self._is_pdf(event, event.src_path):
+            self.readiness.track(event.src_path)
 
-        while attempts < max_attempts:
-            try:
-                if not os.path.exists(file_path):
-                    pub.sendMessage('log_event', message=f"File disappeared: {file_path}")
-                    return False
-
-                # Size stability check
-                initial_size = os.path.getsize(file_path)
-                time.sleep(wait_time)
-                new_size = os.path.getsize(file_path)
-
-                if initial_size != new_size:
-                    stable_checks = 0
-                    pub.sendMessage('log_event', message=f"Size changed: {file_path} ({initial_size} → {new_size})")
-                else:
-                    stable_checks += 1
-                    pub.sendMessage('log_event', message=f"Stable check {stable_checks}/{required_stable_checks}")
-
-                # Lock check and final verification
-                if stable_checks >= required_stable_checks:
-                    if not self._is_file_locked(file_path):
-                        # Final read test
-                        try:
-                            with open(file_path, 'rb') as f:
-                                f.read(1)
-                            pub.sendMessage('log_event', message=f"File ready: {file_path}")
-                            return True
-                        except IOError as e:
-                            pub.sendMessage('log_event', message=f"Final check failed: {str(e)}")
-                    else:
-                        pub.sendMessage('log_event', message=f"File still locked: {file_path}")
-
-                attempts += 1
-
-            except Exception as e:
-                pub.sendMessage('log_event', message=f"Error checking {file_path}: {str(e)}")
-                attempts += 1
-                time.sleep(wait_time)
-
-        pub.sendMessage('log_event', message=f"Failed to process: {file_path}")
-        return False
+    def on_closed(self, event):
+        # IN_CLOSE_WRITE on Linux: the writer is done with the file
+        if self._is_pdf(event, event.src_path):
+            self.readiness.track(event.src_path, closed=True)
+
+    def on_moved(self, event):
+        if self._is_pdf(event, event.src_path):
+            self.readiness.forget(event.src_path)
+        # Only files moved into the watched folder itself count; claims and subfolders are ignored
+        if self._is_pdf(event, event.dest_path) and os.path.dirname(event.dest_path) == self.folder_to_watch:
+            pub.sendMessage('log_event', message=f"New PDF detected: {event.dest_path}")
+            self.readiness.track(event.dest_path, closed=True)
+
+    def on_deleted(self, event):
+        if self._is_pdf(event, event.src_path):
+            self.readiness.forget(event.src_path)
 
 class Watcher:
-    def __init__(self, openai_api_key, language, csv_dir):
+    def __init__(self, openai_api_key, language, csv_dir, on_complete=None):
         self.openai_api_key = openai_api_key
         self.language = language
         self.csv_dir = csv_dir
+        # Called with every finished Job, e.g. by the benchmark harness
+        self.on_complete = on_complete
         self.observer = Observer()
 
     def start(self, output_dir: str, folder_to_watch: str, stop_event):
+        # Imported on start rather than with this module, so a GUI can show its window first
+        from app.src.core import CoreApplication
+
         pub.sendMessage('log_event', message=f"Watching folder: {folder_to_watch}")
         self.app = CoreApplication(self.openai_api_key, self.language, self.csv_dir, output_dir)
-        self.event_handler = PDFHandler(self.app)
+        self.event_handler = PDFHandler(self.app, folder_to_watch, self.on_complete)
+        self.metrics_exporter = MetricsExporter()
+        self.metrics_exporter.start()
+        if self.event_handler.claims:
+            self.event_handler.claims.start()
+        self.event_handler.pipeline.start()
+        self.event_handler.readiness.start()
         self.observer.schedule(self.event_handler, folder_to_watch, recursive=False)
         self.observer.start()
+        startup_profile.mark("watcher ready")
+        if Config.settings.startup_warm_up:
+            # The chat model is otherwise loaded by the first letter to reach the analyze stage
+            threading.Thread(target=self.app.pdf_processor.client.warm_up, name="llm-warm-up", daemon=True).start()
+        # Scanning after the observer starts means files arriving meanwhile are not missed;
+        # the pipeline drops the duplicate when a file is both listed and reported
+        self.event_handler.pipeline.resume_interrupted()
+        if self.event_handler.claims:
+            self.event_handler.resume_claimed()
+        if Config.settings.backlog_scan_enabled:
+            self.event_handler.enqueue_backlog()
         try:
             while not stop_event.is_set():
                 time.sleep(1)
@@ -156,4 +211,9 @@ class Watcher:
             self.observer.stop()
         finally:
             self.observer.stop()
-            self.observer.join()
\ No newline at end of file
+            self.observer.join()
+            self.event_handler.readiness.stop()
+            self.event_handler.pipeline.stop()
+            if self.event_handler.claims:
+                self.event_handler.claims.stop()
+            self.metrics_exporter.stop()
\ No newline at end of file
@@ -1,28 +1,130 @@
 import csv
 import os
-from fuzzywuzzy import process, fuzz
+import threading
+from rapidfuzz import process, fuzz, utils
 
+from config import Config
+
+
+class RecipientIndex:
+    """All recipients from every caseworker CSV, kept in memory and reloaded per file on mtime change"""
 
-class WorkerManager:
     def __init__(self, csv_dir):
         self.csv_dir = csv_dir
+        self.lock = threading.Lock()
+        self.files = {}
+        self.receivers = []
+        self.choices = []
+        self.filenames = []
+        self.postings = {}
+        self.exact = {}
 
-    def find_worker_by_receiver(self, receiver_name):
-        best_match = None
-        highest_score = 0
-
+    def refresh(self):
+        current = {}
+        # Keep directory order: ties go to the first file listed, as in the original scan
         for filename in os.listdir(self.csv_dir):
             if filename.endswith('.csv'):
-                with open(os.path.join(self.csv_dir, filename), newline='') as csvfile:
-                    csv_reader = csv.reader(csvfile)
-                    for row in csv_reader:
-                        if row:
-                            match, score = process.extractOne(receiver_name, row, scorer=fuzz.ratio)
-                            if score > highest_score and score > 70:
-                                best_match = (filename.replace(".csv", ""), filename, match)
-                                highest_score = score
+                current[filename] = os.stat(os.path.join(self.csv_dir, filename)).st_mtime_ns
+
+        with self.lock:
+            if list(current.items()) == [(f, entry[0]) for f, entry in self.files.items()]:
+                return
+
+            files = {}
+            for filename, mtime in current.items():
+                if filename in self.files and self.files[filename][0] == mtime:
+                    files[filename] = self.files[filename]
+                else:
+                    files[filename] = (mtime, self._read_receivers(filename))
+            self.files = files
+
+            self._rebuild()
+
+    def _read_receivers(self, filename):
+        receivers = []
+        with open(os.path.join(self.csv_dir, filename), newline='') as csvfile:
+            for row in csv.reader(csvfile):
+                receivers.extend(cell for cell in row if cell)
+        return receivers
+
+    def _rebuild(self):
+        self.receivers = []
+        self.choices = []
+        self.filenames = []
+        self.postings = {}
+        self.exact = {}
+        for filename in self.files:
+            for receiver in self.files[filename][1]:
+                choice = utils.default_process(receiver)
+                index = len(self.choices)
+                self.receivers.append(receiver)
+                self.choices.append(choice)
+                self.filenames.append(filename)
+                self.exact.setdefault(choice, index)
+                for token in set(choice.split()):
+                    self.postings.setdefault(token, []).append(index)
+
+    def exact_match(self, receiver_name):
+        """Return (filename, receiver) of the first recipient equal to the name up to case and punctuation"""
+        query = utils.default_process(receiver_name or "")
+        with self.lock:
+            index = self.exact.get(query) if query else None
+            if index is None:
+                return None
+            return self.filenames[index], self.receivers[index]
+
+    def best_match(self, receiver_name, threshold):
+        """Return (filename, receiver) for the highest scoring recipient above threshold, or None"""
+        query = utils.default_process(receiver_name or "")
+        if not query:
+            return None
+
+        with self.lock:
+            best = None
+            if Config.settings.recipient_blocking:
+                # Only score recipients sharing a token with the query; fall back to all on no hit
+                indices = sorted({index for token in query.split() for index in self.postings.get(token, ())})
+                best = self._best_of(query, indices, threshold)
+            if best is None:
+                best = self._best_of(query, range(len(self.choices)), threshold)
+            if best is None:
+                return None
+            return self.filenames[best], self.receivers[best]
+
+    def _best_of(self, query, indices, threshold):
+        indices = list(indices)
+        if not indices:
+            return None
+
+        choices = self.choices if len(indices) == len(self.choices) else [self.choices[index] for index in indices]
+        results = process.extract(
+            query, choices,
+            scorer=fuzz.ratio, processor=None, score_cutoff=threshold, limit=None,
+        )
+
+        # Scores are compared as whole numbers, first recipient wins ties, like the per-row scan did
+        best = None
+        for _, score, position in results:
+            rounded = int(round(score))
+            if rounded <= threshold:
+                continue
+            candidate = (-rounded, indices[position])
+            if best is None or candidate < best:
+                best = candidate
+        return best[1] if best else None
+
+
+class WorkerManager:
+    def __init__(self, csv_dir):
+        self.csv_dir = csv_dir
+        self.index = RecipientIndex(csv_dir)
+
+    def find_worker_by_receiver(self, receiver_name):
+        self.index.refresh()
+        best_match = self.index.best_match(receiver_name, threshold=70)
 
         if best_match:
-            return best_match[0], best_match[1], best_match[2]
+            filename, match = best_match
+            return filename.replace(".csv", ""), filename, match
 
-        return None, None, None
\ No newline at end of file
+        return None, None, None
@@ -0,0 +1,11 @@
+import sys
+
+from app.src.startup import enable_from_arguments
+
+# Before the application modules are imported, so their import time is measured too
+sys.argv = enable_from_arguments(sys.argv)
+
+from app.src.batch import main
+
+if __name__ == "__main__":
+    sys.exit(main())
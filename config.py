@@ -1,3 +1,5 @@
+import os
+import threading
 from pydantic import Field
 from pydantic_settings import SettingsConfigDict, BaseSettings
 
@@ -11,10 +13,141 @@ class Settings(BaseSettings):
     failed_dir: str = Field(default="failed")
     unknown_dir: str = Field(default="unknown")
 
+    log_level: str = Field(default="INFO")
+    gui_log_lines: int = Field(default=2000)
+    gui_log_poll_ms: int = Field(default=100)
+    gui_log_batch: int = Field(default=500)
+    transcript_log_path: str = Field(default="logs/transcripts.log")
+    transcript_log_max_mb: int = Field(default=10)
+    transcript_log_backups: int = Field(default=5)
+
+    # Load the OCR and LLM modules in the background once the window or watcher is up
+    startup_warm_up: bool = Field(default=True)
+
+    pipeline_queue_size: int = Field(default=16)
+    readiness_workers: int = Field(default=8)
+    readiness_debounce: float = Field(default=0.5)
+    readiness_poll_interval: float = Field(default=2.0)
+    readiness_timeout: float = Field(default=60.0)
+    backlog_scan_enabled: bool = Field(default=True)
+    backlog_order: str = Field(default="oldest")
+    backlog_progress_interval: float = Field(default=10.0)
+    convert_workers: int = Field(default=2)
+    ocr_stage_workers: int = Field(default=2)
+    ocr_workers: int = Field(default=os.cpu_count() or 1)
+    parallel_ocr: bool = Field(default=True)
+    analyze_workers: int = Field(default=4)
+    route_workers: int = Field(default=2)
+
+    # Scanner batches: split one PDF holding a tray of mail into its letters before OCR
+    split_enabled: bool = Field(default=False)
+    split_workers: int = Field(default=2)
+    split_dpi: int = Field(default=150)
+    # Leave off for duplex scans, where every empty back side would end a letter
+    split_blank_pages: bool = Field(default=True)
+    # Matched against decoded barcodes (needs pyzbar); empty disables separator sheet detection
+    split_barcode_pattern: str = Field(default=r"^(PATCH ?(T|II|2|3)|SEPARATOR)$")
+    split_detect_starts: bool = Field(default=True)
+    split_header_fraction: float = Field(default=0.4)
+    split_dir_name: str = Field(default=".split")
+    # Below output_dir; empty deletes a batch once its letters are written
+    split_originals_dir: str = Field(default="split_originals")
+
+    raster_dpi: int = Field(default=200)
+    raster_grayscale: bool = Field(default=True)
+    raster_thread_count: int = Field(default=1)
+    raster_window: int = Field(default=2)
+    raster_to_disk: bool = Field(default=False)
+
+    text_layer_enabled: bool = Field(default=True)
+    text_layer_min_chars: int = Field(default=40)
+    text_layer_min_quality: float = Field(default=0.6)
+
+    cache_enabled: bool = Field(default=True)
+    cache_path: str = Field(default="cache/results.sqlite3")
+    cache_max_mb: int = Field(default=512)
+    cache_max_age_days: int = Field(default=90)
+
+    claims_enabled: bool = Field(default=False)
+    instance_id: str = Field(default="")
+    claim_dir_name: str = Field(default=".processing")
+    claim_lease_seconds: float = Field(default=30.0)
+
+    metrics_port: int = Field(default=0)
+    metrics_host: str = Field(default="127.0.0.1")
+    metrics_snapshot_path: str = Field(default="")
+    metrics_snapshot_interval: float = Field(default=30.0)
+
+    journal_enabled: bool = Field(default=True)
+    journal_path: str = Field(default="state/journal.sqlite3")
+    # Finished jobs are kept this long for inspection, then deleted; 0 keeps them forever
+    journal_max_age_days: int = Field(default=30)
+
+    recipient_blocking: bool = Field(default=False)
+
+    # "auto" uses tesserocr when it is installed and pytesseract otherwise
+    ocr_backend: str = Field(default="auto")
+    ocr_language: str = Field(default="eng")
+    ocr_psm: int = Field(default=3)
+    ocr_oem: int = Field(default=3)
+    tessdata_path: str = Field(default="")
+
+    preprocess_enabled: bool = Field(default=True)
+    preprocess_target_dpi: int = Field(default=300)
+    preprocess_remove_borders: bool = Field(default=True)
+    preprocess_skip_blank: bool = Field(default=True)
+    preprocess_blank_ink_ratio: float = Field(default=0.003)
+    preprocess_deskew: bool = Field(default=True)
+    preprocess_max_skew: float = Field(default=5.0)
+    preprocess_binarize: bool = Field(default=True)
+    preprocess_binarize_threshold: float = Field(default=0.15)
+
+    roi_ocr_enabled: bool = Field(default=False)
+    # (left, top, right, bottom) as fractions of page 1; the default covers letterhead and address window
+    roi_regions: list[tuple[float, float, float, float]] = Field(default=[(0.0, 0.0, 1.0, 0.4)])
+    roi_min_confidence: float = Field(default=60.0)
+    roi_required_fields: list[str] = Field(default=["sender", "receiver", "date_of_writing"])
+
+    pre_extract_enabled: bool = Field(default=True)
+    # Fields scoring below this are asked from the LLM; with only type_of_letter left, a short summary prompt is used
+    pre_extract_min_confidence: float = Field(default=0.9)
+    # Only these fields (plus the type_of_letter summary) have to reach the confidence; they decide where a letter goes
+    pre_extract_required_fields: list[str] = Field(default=["receiver", "date_of_writing", "organisation"])
+    pre_extract_fuzzy_threshold: int = Field(default=90)
+    # Raise to pre_extract_min_confidence to take subject lines as the summary and skip the LLM entirely
+    pre_extract_subject_confidence: float = Field(default=0.5)
+    pre_extract_summary_chars: int = Field(default=2000)
+
+    openai_base_url: str = Field(default="")
+    llm_model: str = Field(default="gpt-4o")
+    llm_timeout: float = Field(default=60.0)
+    llm_max_concurrency: int = Field(default=4)
+    llm_requests_per_minute: int = Field(default=500)
+    llm_tokens_per_minute: int = Field(default=30000)
+    llm_completion_token_estimate: int = Field(default=150)
+    llm_max_retries: int = Field(default=5)
+    llm_backoff_base: float = Field(default=1.0)
+    llm_backoff_max: float = Field(default=30.0)
+
     model_config = SettingsConfigDict(
         env_file=".env",
         env_file_encoding="utf-8"
     )
 
+class LazySettings:
+    """Reads the environment and .env on first access instead of when config is imported"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.settings = None
+
+    def __get__(self, instance, owner):
+        if self.settings is None:
+            with self.lock:
+                if self.settings is None:
+                    self.settings = Settings()
+        return self.settings
+
+
 class Config: 
-    settings: Settings = Settings()
\ No newline at end of file
+    settings: Settings = LazySettings()
\ No newline at end of file
@@ -0,0 +1 @@
+# Lets the tests import config and app.src from the repository root
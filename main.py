@@ -1,8 +1,18 @@
+import sys
+from app.src.startup import enable_from_arguments, startup_profile
+
+# Before the application modules are imported, so their import time is measured too
+sys.argv = enable_from_arguments(sys.argv)
+
 from app.src.gui import GUI
 import tkinter as tk
 
 if __name__ == "__main__":
+    startup_profile.mark("imports")
     root = tk.Tk()
     root.title("File Watcher")
     gui = GUI(root)
+    startup_profile.mark("window created")
+    # Runs once the window has been drawn and the event loop is idle
+    root.after_idle(gui.on_window_shown)
     root.mainloop()
\ No newline at end of file
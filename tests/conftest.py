@@ -0,0 +1,72 @@
+import os
+
+import pytest
+
+from app.src import journal as journal_module
+from app.src.core import move_file
+from app.src.journal import JobJournal
+from app.src.models import LetterDetails
+
+
+class FakeApplication:
+    """Stands in for CoreApplication: every stage succeeds, routing moves the file into output_dir"""
+
+    dry_run = False
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.calls = []
+
+    def hash_document(self, pdf_path):
+        return None
+
+    def convert_pdf_to_images(self, pdf_path, file_hash=None):
+        self.calls.append("convert")
+        return ["page"]
+
+    def perform_ocr(self, pages, file_hash=None):
+        self.calls.append("ocr")
+        return "Dear Sir or Madam"
+
+    def analyze_text(self, ocr_text):
+        self.calls.append("analyze")
+        return LetterDetails(receiver="Max Mustermann", date_of_writing="2024-03-12", organisation="",
+                             sender="", type_of_letter="Bill", responsible_person="")
+
+    def find_worker(self, letter_details):
+        self.calls.append("find_worker")
+        return "Erika", "Erika.csv", letter_details.receiver
+
+    def resolve_output_path(self, pdf_path, letter_details, worker_name, matched_receiver):
+        return os.path.join(self.output_dir, os.path.basename(pdf_path))
+
+    def reserve_output_path(self, path):
+        pass
+
+    def move_pdf(self, pdf_path, pdf_output_path):
+        self.calls.append("move")
+        move_file(pdf_path, pdf_output_path)
+        return pdf_output_path
+
+
+@pytest.fixture
+def fake_app(tmp_path):
+    output_dir = tmp_path / "out"
+    output_dir.mkdir()
+    return FakeApplication(str(output_dir))
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    """A journal in tmp_path that the pipeline picks up instead of the configured one"""
+    journal = JobJournal(str(tmp_path / "journal.sqlite3"))
+    monkeypatch.setattr(journal_module, "_journal", journal)
+    yield journal
+    journal.close()
+
+
+@pytest.fixture
+def inbox(tmp_path):
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    return inbox
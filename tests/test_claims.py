@@ -0,0 +1,120 @@
+import multiprocessing
+import os
+import time
+
+from app.src.claims import LEASE_FILE, InboxClaims
+
+
+def write_pdf(path, content=b"%PDF-1.4"):
+    with open(path, "wb") as f:
+        f.write(content)
+    return str(path)
+
+
+def make_claims(inbox, instance_id, lease_seconds=30):
+    claims = InboxClaims(str(inbox), instance_id, ".processing", lease_seconds)
+    claims.start()
+    return claims
+
+
+def test_only_one_instance_claims_a_file(inbox):
+    pdf_path = write_pdf(inbox / "letter.pdf")
+    first, second = make_claims(inbox, "first"), make_claims(inbox, "second")
+    try:
+        claimed = first.claim(pdf_path)
+        assert claimed == os.path.join(first.directory, "letter.pdf")
+        assert second.claim(pdf_path) is None
+        assert first.owns(claimed) and not second.owns(claimed)
+    finally:
+        first.stop()
+        second.stop()
+
+
+def test_claim_keeps_a_file_of_the_same_name_in_flight(inbox):
+    claims = make_claims(inbox, "first")
+    try:
+        earlier = claims.claim(write_pdf(inbox / "letter.pdf", b"earlier"))
+        later = claims.claim(write_pdf(inbox / "letter.pdf", b"later"))
+        assert later != earlier
+        with open(earlier, "rb") as f:
+            assert f.read() == b"earlier"
+    finally:
+        claims.stop()
+
+
+def test_claims_of_a_stale_lease_go_back_to_the_inbox(inbox):
+    crashed = make_claims(inbox, "crashed", lease_seconds=1)
+    claimed = crashed.claim(write_pdf(inbox / "letter.pdf"))
+    # A crashed process neither renews nor removes its lease
+    crashed.stop_event.set()
+    crashed.thread.join()
+    stale = time.time() - 60
+    os.utime(os.path.join(crashed.directory, LEASE_FILE), (stale, stale))
+
+    survivor = make_claims(inbox, "survivor", lease_seconds=1)
+    try:
+        assert not os.path.exists(claimed)
+        assert os.path.exists(inbox / "letter.pdf")
+        assert not os.path.exists(crashed.directory)
+    finally:
+        survivor.stop()
+
+
+def test_recovery_leaves_a_live_lease_alone(inbox):
+    live = make_claims(inbox, "live")
+    claimed = live.claim(write_pdf(inbox / "letter.pdf"))
+    other = make_claims(inbox, "other")
+    try:
+        assert os.path.exists(claimed)
+        assert live.claimed_files() == [claimed]
+    finally:
+        live.stop()
+        other.stop()
+
+
+def test_recovered_file_does_not_overwrite_a_new_one(inbox):
+    crashed = make_claims(inbox, "crashed")
+    crashed.claim(write_pdf(inbox / "letter.pdf", b"old"))
+    crashed.stop()
+    write_pdf(inbox / "letter.pdf", b"new")
+
+    survivor = make_claims(inbox, "survivor")
+    try:
+        assert sorted(os.listdir(inbox)) == [".processing", "letter.pdf", "letter_recovered1.pdf"]
+        with open(inbox / "letter.pdf", "rb") as f:
+            assert f.read() == b"new"
+    finally:
+        survivor.stop()
+
+
+def test_release_returns_a_claim_under_its_name(inbox):
+    claims = make_claims(inbox, "first")
+    try:
+        claimed = claims.claim(write_pdf(inbox / "letter.pdf"))
+        assert claims.release(claimed, "letter.pdf") == os.path.join(str(inbox), "letter.pdf")
+        assert claims.claimed_files() == []
+    finally:
+        claims.stop()
+
+
+def claim_all(inbox, instance_id, names, results):
+    claims = make_claims(inbox, instance_id)
+    try:
+        results.put([name for name in names if claims.claim(os.path.join(inbox, name))])
+    finally:
+        claims.stop()
+
+
+def test_processes_sharing_an_inbox_claim_each_file_once(inbox):
+    names = [os.path.basename(write_pdf(inbox / f"letter{index:03d}.pdf")) for index in range(200)]
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    processes = [context.Process(target=claim_all, args=(str(inbox), f"instance{index}", names, results))
+                 for index in range(3)]
+    for process in processes:
+        process.start()
+    claimed = [results.get(timeout=30) for _ in processes]
+    for process in processes:
+        process.join()
+
+    assert sorted(name for names_claimed in claimed for name in names_claimed) == names
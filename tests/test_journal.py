@@ -0,0 +1,127 @@
+import os
+import time
+
+import pytest
+
+from app.src import journal as job_states
+from app.src.cache import hash_file
+from app.src.core import move_file
+from app.src.journal import JobJournal
+from app.src.pipeline import Pipeline
+
+
+def write_pdf(path, content=b"%PDF-1.4"):
+    with open(path, "wb") as f:
+        f.write(content)
+    return str(path)
+
+
+def interrupted_job(journal, pdf_path, state, output_path):
+    """Journal entry as a run that stopped right after reaching state would have left it"""
+    entry = journal.begin(pdf_path, hash_file(pdf_path))
+    if state in (job_states.OCR_DONE, job_states.ANALYZED, job_states.ROUTING):
+        journal.record_ocr(entry["id"], "Dear Sir or Madam")
+    if state in (job_states.ANALYZED, job_states.ROUTING):
+        journal.record_analysis(entry["id"], '{"receiver": "Max Mustermann", "date_of_writing": "2024-03-12", '
+                                             '"organisation": "", "sender": "", "type_of_letter": "Bill", '
+                                             '"responsible_person": ""}')
+    if state == job_states.ROUTING:
+        journal.record_route(entry["id"], "Erika", "Erika.csv", "Max Mustermann", output_path)
+    return entry["id"]
+
+
+def resume(app):
+    pipeline = Pipeline(app)
+    pipeline.start()
+    try:
+        pipeline.resume_interrupted()
+    finally:
+        pipeline.stop()
+
+
+def job_row(journal, job_id):
+    return dict(journal.connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone())
+
+
+@pytest.mark.parametrize("state, calls", [
+    (job_states.RECEIVED, ["convert", "ocr", "analyze", "find_worker", "move"]),
+    (job_states.OCR_DONE, ["analyze", "find_worker", "move"]),
+    (job_states.ANALYZED, ["find_worker", "move"]),
+    (job_states.ROUTING, ["move"]),
+])
+def test_resume_repeats_only_the_stages_not_done(inbox, fake_app, journal, state, calls):
+    pdf_path = write_pdf(inbox / "letter.pdf")
+    output_path = os.path.join(fake_app.output_dir, "letter.pdf")
+    job_id = interrupted_job(journal, pdf_path, state, output_path)
+
+    resume(fake_app)
+
+    assert fake_app.calls == calls
+    assert os.path.exists(output_path) and not os.path.exists(pdf_path)
+    row = job_row(journal, job_id)
+    assert row["state"] == job_states.DONE
+    assert row["ocr_text"] is None
+
+
+def test_resume_completes_a_move_that_finished_before_the_stop(inbox, fake_app, journal):
+    pdf_path = write_pdf(inbox / "letter.pdf")
+    output_path = os.path.join(fake_app.output_dir, "letter.pdf")
+    job_id = interrupted_job(journal, pdf_path, job_states.ROUTING, output_path)
+    os.replace(pdf_path, output_path)
+
+    resume(fake_app)
+
+    assert fake_app.calls == []
+    assert job_row(journal, job_id)["state"] == job_states.DONE
+
+
+def test_resume_fails_a_job_whose_file_is_gone(inbox, fake_app, journal):
+    pdf_path = write_pdf(inbox / "letter.pdf")
+    job_id = interrupted_job(journal, pdf_path, job_states.OCR_DONE, None)
+    os.remove(pdf_path)
+
+    resume(fake_app)
+
+    row = job_row(journal, job_id)
+    assert row["state"] == job_states.FAILED
+    assert row["error"] == "source file disappeared"
+
+
+def test_new_content_under_the_same_name_supersedes_the_old_entry(inbox, journal):
+    pdf_path = write_pdf(inbox / "letter.pdf", b"first")
+    old = journal.begin(pdf_path, hash_file(pdf_path))
+    write_pdf(pdf_path, b"second")
+    new = journal.begin(pdf_path, hash_file(pdf_path))
+
+    assert new["id"] != old["id"]
+    assert job_row(journal, old["id"])["state"] == job_states.FAILED
+
+
+def test_move_file_is_safe_to_repeat(tmp_path):
+    source = write_pdf(tmp_path / "letter.pdf", b"letter")
+    destination = str(tmp_path / "routed.pdf")
+
+    move_file(source, destination)
+    move_file(source, destination)
+
+    assert not os.path.exists(source)
+    with open(destination, "rb") as f:
+        assert f.read() == b"letter"
+
+
+def test_prune_deletes_only_old_finished_jobs(tmp_path):
+    journal = JobJournal(str(tmp_path / "journal.sqlite3"), max_age_days=30)
+    finished = journal.begin("/inbox/done.pdf", "a")["id"]
+    journal.complete(finished, "/out/done.pdf")
+    unfinished = journal.begin("/inbox/open.pdf", "b")["id"]
+    recent = journal.begin("/inbox/recent.pdf", "c")["id"]
+    journal.complete(recent, "/out/recent.pdf")
+    long_ago = time.time() - 31 * 24 * 3600
+    journal.connection.execute("UPDATE jobs SET updated_at = ? WHERE id IN (?, ?)", (long_ago, finished, unfinished))
+    journal.connection.commit()
+
+    journal.prune()
+
+    remaining = {row[0] for row in journal.connection.execute("SELECT id FROM jobs")}
+    assert remaining == {unfinished, recent}
+    journal.close()
@@ -0,0 +1,43 @@
+import csv
+
+from config import Config
+from app.src.pre_extractor import PreExtractor
+from app.src.worker_manager import RecipientIndex
+
+LETTER_WITHOUT_LABELS = """Stadtwerke München GmbH
+Postfach 1234, 80001 München
+Herrn
+Max Mustermann
+Hauptstr. 5
+12345 Berlin
+München, 12. März 2024
+Jahresabrechnung Strom 2023
+Sehr geehrter Herr Mustermann,
+bitte überweisen Sie den Betrag bis zum 01.04.2024.
+"""
+
+
+def make_extractor(tmp_path):
+    with open(tmp_path / "Erika_Musterfrau.csv", "w", newline="") as f:
+        csv.writer(f).writerows([["Max Mustermann"], ["Anna Schmidt"]])
+    settings = Config.settings
+    return PreExtractor(RecipientIndex(str(tmp_path)), settings.pre_extract_fuzzy_threshold,
+                        settings.pre_extract_subject_confidence)
+
+
+def test_letter_without_from_label_reaches_routing_confidence(tmp_path):
+    extraction = make_extractor(tmp_path).extract(LETTER_WITHOUT_LABELS)
+
+    assert extraction.values["receiver"] == "Max Mustermann"
+    assert extraction.values["date_of_writing"] == "12. März 2024"
+    assert extraction.values["organisation"] == "Stadtwerke München GmbH"
+    # Only the summary is left for the LLM
+    fields = list(Config.settings.pre_extract_required_fields) + ["type_of_letter"]
+    assert extraction.uncertain_fields(Config.settings.pre_extract_min_confidence, fields) == ["type_of_letter"]
+
+
+def test_several_recipients_in_header_are_not_trusted(tmp_path):
+    text = LETTER_WITHOUT_LABELS.replace("12345 Berlin", "Anna Schmidt")
+    extraction = make_extractor(tmp_path).extract(text)
+
+    assert extraction.confidence["receiver"] < Config.settings.pre_extract_min_confidence
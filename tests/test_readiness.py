@@ -0,0 +1,46 @@
+import os
+import sqlite3
+import threading
+
+from app.src.claims import InboxClaims
+from app.src.pipeline import Pipeline
+from app.src.readiness import ReadinessTracker
+
+
+def test_file_is_processed_after_journal_error(inbox, fake_app, journal, monkeypatch):
+    pdf_path = str(inbox / "letter.pdf")
+    with open(pdf_path, "wb") as f:
+        f.write(b"%PDF-1.4")
+
+    begin = journal.begin
+    calls = []
+
+    def begin_failing_once(*args):
+        calls.append(args)
+        if len(calls) == 1:
+            raise sqlite3.OperationalError("database is locked")
+        return begin(*args)
+
+    monkeypatch.setattr(journal, "begin", begin_failing_once)
+
+    done = threading.Event()
+    jobs = []
+    claims = InboxClaims(str(inbox), "test", ".processing", lease_seconds=30)
+    claims.start()
+    pipeline = Pipeline(fake_app, on_complete=lambda job: (jobs.append(job), done.set()), claims=claims)
+    readiness = ReadinessTracker(lambda path: False, pipeline.submit, debounce=0, poll_interval=0.05,
+                                 timeout=1, workers=1)
+    pipeline.start()
+    readiness.start()
+    try:
+        readiness.track(pdf_path, closed=True)
+        assert done.wait(10)
+    finally:
+        readiness.stop()
+        pipeline.stop()
+        claims.stop()
+
+    assert len(calls) == 2
+    assert jobs[0].failed_stage is None
+    assert os.listdir(fake_app.output_dir) == ["letter.pdf"]
+    assert not pipeline.in_flight